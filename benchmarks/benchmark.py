@@ -0,0 +1,154 @@
+"""
+Time every stage of the harvest and update against local mock servers, without touching the
+UU staff pages or Pure. For example:
+
+    python benchmarks/benchmark.py --persons 5000 --latency-ms 20 --error-rate 0.01
+
+Each stage reports its wall time, throughput and peak memory; --output writes them as json.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import mock_servers
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+CONFIG_TEMPLATE = """
+[Pure]
+pure_api_key_crud = benchmark
+pure_api_key_old = benchmark
+api_url_persons_old = {base_url}{persons_old_path}
+api_url_persons_search = {base_url}{persons_search_path}
+api_url_base = {base_url}/ws/api/
+uri_profile_en = /dk/atira/pure/person/customfields/profiel_eng
+
+[PP]
+api = {base_url}{pp_api_path}
+filestaff = uustaff_harvest.json
+
+[HTTP]
+backoff_factor = 0.01
+backoff_jitter = 0.01
+"""
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the harvest and update stages against local mock servers.')
+    parser.add_argument('--persons', type=int, default=1000, help='size of the synthetic population')
+    parser.add_argument('--latency-ms', type=float, default=0, help='latency of every mock request')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of mock requests answered with 503')
+    parser.add_argument('--changed-fraction', type=float, default=0.1,
+                        help='fraction of persons whose Pure data differs from the staff pages')
+    parser.add_argument('--photo-kb', type=int, default=30, help='size of the synthetic photos')
+    parser.add_argument('--harvest-employees', action='store_true',
+                        help='also time harvest_json_uustaffpages (organogram and employee pages)')
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help='do not trace Python allocations, which slows down the stages')
+    parser.add_argument('--output', help='write the results as json to this file')
+    return parser.parse_args()
+
+
+def run_stage(results: list, name: str, function, count_items, trace: bool):
+    """
+    Run one stage and record its wall time, throughput and peak memory.
+
+    :param results: The list the measurement is appended to.
+    :param name: The name of the stage.
+    :param function: The stage, called without arguments.
+    :param count_items: A function that returns the number of items the stage handled, given its output.
+    :param trace: If True, measure the peak of Python allocations with tracemalloc.
+    :return: The output of the stage.
+    """
+    if trace:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    output = function()
+    seconds = time.perf_counter() - start
+    items = count_items(output)
+    result = {
+        'stage': name,
+        'seconds': round(seconds, 3),
+        'items': items,
+        'items_per_second': round(items / seconds, 1) if seconds else None,
+        'peak_python_mb': round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if trace else None,
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    results.append(result)
+    print(f"\n>>> {name}: {result['seconds']}s, {items} items, {result['items_per_second']}/s, "
+          f"peak {result['peak_python_mb']} MB\n")
+    return output
+
+
+def main():
+    args = parse_arguments()
+    work_dir = tempfile.mkdtemp(prefix='pp_to_pure_benchmark_')
+    print(f'Building a population of {args.persons} persons in {work_dir}')
+    population = mock_servers.Population(args.persons, changed_fraction=args.changed_fraction,
+                                         photo_kb=args.photo_kb)
+    server = mock_servers.start_server(population, latency=args.latency_ms / 1000, error_rate=args.error_rate)
+
+    config_path = os.path.join(work_dir, 'config.ini')
+    with open(config_path, 'w') as config_file:
+        config_file.write(CONFIG_TEMPLATE.format(base_url=population.base_url,
+                                                 persons_old_path=mock_servers.PERSONS_OLD_PATH,
+                                                 persons_search_path=mock_servers.PERSONS_SEARCH_PATH,
+                                                 pp_api_path=mock_servers.PP_API_PATH))
+
+    # The configuration is read when harvestpp is imported, so point to it first.
+    sys.path.insert(0, SRC_DIR)
+    import settings
+    settings.CONFIG_FILE = config_path
+    # Every module reads the files and photos directories from settings, when it uses them.
+    settings.files_dir = os.path.join(work_dir, 'files')
+    settings.photos_dir = os.path.join(work_dir, 'photos')
+    import harvestpp as pp
+    import metrics
+    import pipeline
+    import storage
+
+    trace = not args.no_tracemalloc
+    if trace:
+        tracemalloc.start()
+    results = []
+    if args.harvest_employees:
+        run_stage(results, 'harvest_json_uustaffpages',
+                  lambda: pp.harvest_json_uustaffpages(pp.API_PP), len, trace)
+    solislist = run_stage(results, 'persons_active', lambda: pp.persons_active(full_sync=True), len, trace)
+    parsed_results = run_stage(results, 'connect_pure_with_uustaffpages',
+                               lambda: pp.connect_pure_with_uustaffpages(pp.API_PP, solislist), len, trace)
+    run_stage(results, 'dowload_profilepictures', lambda: pp.dowload_profilepictures(parsed_results), len, trace)
+    run_stage(results, 'dowload_profilepictures (unchanged)',
+              lambda: pp.dowload_profilepictures(parsed_results), len, trace)
+
+    merged_df = run_stage(results, 'load uustaff_results',
+                          lambda: storage.read_table(storage.table_path('uustaff_results'),
+                                                     storage.UUSTAFF_RESULTS_SCHEMA), len, trace)
+    # The pipeline of update_pure.py: a dry run fetches, updates and compares every person, a full run
+    # also writes the changed ones. The first run fills the local cache of Pure persons, the others use it.
+    run_stage(results, 'pipeline.stream_update (dry run, empty cache)',
+              lambda: pipeline.stream_update(merged_df, dry_run=True), lambda out: len(merged_df), trace)
+    run_stage(results, 'pipeline.stream_update (fetch to PUT)',
+              lambda: pipeline.stream_update(merged_df), len, trace)
+    run_stage(results, 'pipeline.stream_update (dry run, cached)',
+              lambda: pipeline.stream_update(merged_df, dry_run=True), lambda out: len(merged_df), trace)
+    server.shutdown()
+
+    print(f"{'stage':45} {'seconds':>9} {'items':>7} {'items/s':>9} {'peak MB':>8}")
+    for result in results:
+        print(f"{result['stage']:45} {result['seconds']:>9} {result['items']:>7} "
+              f"{result['items_per_second']!s:>9} {result['peak_python_mb']!s:>8}")
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'arguments': vars(args), 'stages': results, 'metrics': metrics.summary()},
+                      output_file, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import io
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid as uuid_module
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow the photos are random bytes between jpeg markers.
+    Image = None
+
+NR_OF_FACULTIES = 25
+PERSONS_OLD_PATH = '/ws/api/524/persons/active'
+PERSONS_SEARCH_PATH = '/ws/api/persons/search'
+PERSONS_PATH = '/ws/api/persons/'
+PP_API_PATH = '/medewerkers/RestApi'
+
+
+def make_photo(rng: random.Random, size_kb: int) -> bytes:
+    """
+    :return: A jpeg of roughly size_kb kilobytes.
+    """
+    if Image is not None:
+        side = max(8, int((size_kb * 1024 / 3) ** 0.5))
+        image = Image.frombytes('RGB', (side, side), rng.randbytes(side * side * 3))
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=95)
+        return buffer.getvalue()
+    return b'\xff\xd8' + rng.randbytes(size_kb * 1024) + b'\xff\xd9'
+
+
+class Population:
+    """
+    A synthetic population of staff members, consistent between the UU staff pages and Pure.
+    A fraction of the persons in Pure is out of date, the others already hold what the staff
+    pages say, so the diff and write stages get realistic work.
+    """
+
+    def __init__(self, size: int, changed_fraction: float = 0.1, photo_kb: int = 30,
+                 photo_variants: int = 20, seed: int = 1):
+        rng = random.Random(seed)
+        self.photos = [make_photo(rng, photo_kb) for _ in range(photo_variants)]
+        self.persons = []
+        for nr in range(size):
+            self.persons.append({
+                'uuid': str(uuid_module.UUID(int=rng.getrandbits(128), version=4)),
+                'solis_id': f'S{nr:06d}',
+                'page_id': f'p.person{nr}',
+                'faculty': nr % NR_OF_FACULTIES,
+                'email': f'p.person{nr}@uu.nl',
+                'bio': f'<p>Researcher number {nr}. ' + 'Lorem ipsum dolor sit amet. ' * rng.randint(1, 20) + '</p>',
+                'consent': rng.random() < 0.8,
+                'photo': nr % photo_variants,
+                'in_sync': rng.random() >= changed_fraction,
+                'version': 1,
+            })
+        self.by_uuid = {person['uuid']: person for person in self.persons}
+        self.by_solis_id = {person['solis_id']: person for person in self.persons}
+        self.by_page_id = {person['page_id']: person for person in self.persons}
+        self.base_url = ''
+
+    def staff_page_url(self, person) -> str:
+        return f'https://www.uu.nl/staff/{person["page_id"]}'
+
+    def pure_person(self, person) -> dict:
+        """The CRUD API json of a person, in sync with the staff pages or not."""
+        document = {
+            'uuid': person['uuid'],
+            'version': str(person['version']),
+            'name': {'firstName': 'P.', 'lastName': person['page_id']},
+            'staffOrganizationAssociations': [{
+                'period': {'startDate': '2015-01-01'},
+                'organization': {'uuid': '00000000-0000-0000-0000-000000000001'},
+            }],
+        }
+        if person['in_sync']:
+            link = self.staff_page_url(person)
+            document['profileInformation'] = [
+                {'value': {'en_GB': person['bio']},
+                 'type': {'uri': '/dk/atira/pure/person/customfields/profiel_eng', 'term': {'en_GB': 'About'}}},
+                {'value': {'en_GB': f'<p><a href="{link}">{link}</a></p>'},
+                 'type': {'uri': '/dk/atira/pure/person/customfields/profiel_url',
+                          'term': {'en_GB': 'Link to Utrecht University staff page'}}},
+            ]
+            document['staffOrganizationAssociations'][0]['emails'] = [{'value': person['email']}]
+            if person['consent']:
+                document['profilePhotos'] = [{'fileName': 'profilepicture.jpg', 'url': 'https://pure/photo'}]
+        return document
+
+    def old_api_person(self, person) -> dict:
+        """The old API json of an active person."""
+        return {
+            'uuid': person['uuid'],
+            'ids': [
+                {'type': {'term': {'text': [{'value': 'Scopus Author ID'}]}}, 'value': {'value': '123'}},
+                {'type': {'term': {'text': [{'value': 'Employee ID'}]}}, 'value': {'value': person['solis_id']}},
+            ],
+            'info': {'modifiedDate': '2024-01-01T00:00:00.000+0000'},
+        }
+
+    def staff_page(self, person) -> dict:
+        """The getmedewerkers json of a person."""
+        return {
+            'SolisID': person['solis_id'],
+            'UrlEN': self.staff_page_url(person),
+            'UrlNL': self.staff_page_url(person).replace('/staff/', '/medewerkers/'),
+            'Email': person['email'],
+            'DescriptionEN': person['bio'],
+            'DescriptionNL': None,
+            'UrlProfielfoto': f'{self.base_url}/photos/{person["page_id"]}.jpg',
+            'ToestemmingProfielfotoInExterneApps': person['consent'],
+        }
+
+
+def make_handler(population: Population, latency: float, error_rate: float):
+    """
+    :param population: The persons the server knows.
+    :param latency: Seconds every request takes.
+    :param error_rate: The fraction of requests answered with 503.
+    :return: A request handler class for ThreadingHTTPServer.
+    """
+    rng = random.Random()
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body=b'', content_type='application/json', headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, data, status=200):
+            self._send(status, json.dumps(data).encode('utf-8'))
+
+        def _simulate(self) -> bool:
+            """Wait for the configured latency; return False if this request should fail."""
+            if latency:
+                time.sleep(latency)
+            with rng_lock:
+                failed = rng.random() < error_rate
+            if failed:
+                self._send(503, b'{"error": "unavailable"}', headers={'Retry-After': '0'})
+            return not failed
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            if not self._simulate():
+                return
+
+            if url.path.endswith('/Public/GetEmployeesOrganogram'):
+                faculty = int(query['f'][0])
+                employees = [{'Url': person['page_id']} for person in population.persons
+                             if person['faculty'] == faculty]
+                self._send_json({'Employees': employees})
+            elif url.path.endswith('/Public/getEmployeeData'):
+                person = population.by_page_id.get(query['page'][0])
+                if person is None:
+                    self._send_json({})
+                    return
+                self._send_json({'Employee': {'Email': person['email'], 'Bio': person['bio'],
+                                              'PhotoUrl': population.staff_page(person)['UrlProfielfoto']}})
+            elif url.path.endswith('/RestApi/getmedewerkers'):
+                solis_ids = query['selectie'][0].split(':', 1)[1].split(',')
+                self._send_json([population.staff_page(population.by_solis_id[solis_id])
+                                 for solis_id in solis_ids if solis_id in population.by_solis_id])
+            elif url.path.startswith('/photos/'):
+                person = population.by_page_id.get(url.path[len('/photos/'):-len('.jpg')])
+                if person is None:
+                    self._send(404)
+                    return
+                etag = f'"photo-{person["photo"]}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self._send(304, headers={'ETag': etag})
+                    return
+                self._send(200, population.photos[person['photo']], 'image/jpeg', {'ETag': etag})
+            elif url.path == PERSONS_OLD_PATH:
+                page_size = int(query['pageSize'][0])
+                page = int(query['page'][0])
+                items = population.persons[(page - 1) * page_size:page * page_size]
+                self._send_json({'count': len(population.persons),
+                                 'items': [population.old_api_person(person) for person in items]})
+            else:
+                self._send(404)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not self._simulate():
+                return
+            if urllib.parse.urlsplit(self.path).path != PERSONS_SEARCH_PATH:
+                self._send(404)
+                return
+            uuids = json.loads(body)['uuids']
+            self._send_json({'count': len(uuids),
+                             'items': [population.pure_person(population.by_uuid[uuid])
+                                       for uuid in uuids if uuid in population.by_uuid]})
+
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not self._simulate():
+                return
+            path = urllib.parse.urlsplit(self.path).path
+            person = population.by_uuid.get(path[len(PERSONS_PATH):]) if path.startswith(PERSONS_PATH) else None
+            if person is None:
+                self._send(404)
+                return
+            document = json.loads(body)
+            person['version'] += 1
+            document['version'] = str(person['version'])
+            self._send_json(document)
+
+    return Handler
+
+
+def start_server(population: Population, latency: float = 0.0, error_rate: float = 0.0):
+    """
+    Start a mock of the UU staff pages, the old Pure API and the Pure CRUD API on a free local port.
+
+    :return: The server, running in a daemon thread. Its base url is also set on the population.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(population, latency, error_rate))
+    server.daemon_threads = True
+    population.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
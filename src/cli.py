@@ -0,0 +1,103 @@
+"""
+Command line entry point without prompts, e.g.
+
+    python src/cli.py harvest --yes
+    python src/cli.py update-all --dry-run
+    python src/cli.py update-one 1234567
+
+Only the modules a subcommand needs are imported, when it runs, so '--help' and a
+single-person update start without loading pandas, the harvest or the configuration.
+"""
+import argparse
+
+
+def confirm(args, question: str):
+    """Ask the question unless --yes or --dry-run was given, and stop if the answer is not yes."""
+    if args.yes or args.dry_run:
+        return
+    if input(f'{question} (y/n): ').strip().lower() != 'y':
+        print('Aborting.')
+        raise SystemExit(0)
+
+
+def harvest(args):
+    import harvestpp as pp
+    import metrics
+    import stages
+
+    stage_list = pp.harvest_stages(full_sync=args.full_sync)
+    stage_names = [stage.name for stage in stage_list] + ['all']
+    unknown = [name for name in args.force + args.skip if name not in stage_names]
+    if unknown:
+        raise SystemExit(f"Unknown stage {', '.join(unknown)}, choose from {', '.join(stage_names)}")
+    force = args.force + (['persons'] if args.full_sync else [])
+    if args.dry_run:
+        for name, reason in stages.plan_stages(stage_list, force=force, skip=args.skip).items():
+            print(f"[stage {name}] {'would run: ' + reason if reason else 'up to date, would use the cached output'}")
+        return
+    confirm(args, 'Harvest the UU staff pages and connect them with Pure?')
+    stages.run_stages(stage_list, force=force, skip=args.skip)
+    metrics.write_summary('harvestpp')
+
+
+def update_all(args, resume: bool = False):
+    import metrics
+    import update_pure
+
+    merged_df = update_pure.load_uustaff_results()
+    confirm(args, 'Update all persons in Pure? This action cannot be undone.')
+    update_pure.update_all_persons(merged_df, resume=resume, dry_run=args.dry_run)
+    metrics.write_summary('update_pure')
+
+
+def resume(args):
+    update_all(args, resume=True)
+
+
+def update_one(args):
+    import metrics
+    import update_pure
+
+    update_pure.update_single_person(args.solisid, dry_run=args.dry_run)
+    metrics.write_summary('update_pure')
+
+
+def parse_arguments(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--yes', '-y', action='store_true', help='do not ask for confirmation')
+    common.add_argument('--dry-run', action='store_true',
+                        help='show what would be done without writing to Pure (harvest: without running stages)')
+
+    parser = argparse.ArgumentParser(description='Harvest the UU staff pages and update the persons in Pure.')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    harvest_parser = subcommands.add_parser('harvest', parents=[common],
+                                            help='harvest the staff pages and connect them with Pure')
+    harvest_parser.add_argument('--full-sync', action='store_true',
+                                help='ignore the snapshot of active persons and harvest all of them again')
+    harvest_parser.add_argument('--force', action='append', default=[], metavar='STAGE',
+                                help="run this stage (persons, connect, photos or all) even if its cached "
+                                     "output is up to date (can be repeated)")
+    harvest_parser.add_argument('--skip', action='append', default=[], metavar='STAGE',
+                                help='use the cached output of this stage even if it is outdated (can be repeated)')
+    harvest_parser.set_defaults(function=harvest)
+
+    subcommands.add_parser('update-all', parents=[common],
+                           help='update all persons in Pure').set_defaults(function=update_all)
+    subcommands.add_parser('resume', parents=[common],
+                           help='resume an interrupted update of all persons').set_defaults(function=resume)
+
+    update_one_parser = subcommands.add_parser('update-one', parents=[common],
+                                               help='update a single person, by SolisID')
+    update_one_parser.add_argument('solisid', help='the SolisID of the person')
+    update_one_parser.set_defaults(function=update_one)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,30 @@
-import base64
+import argparse
+import collections
+import hashlib
 import requests
 import os
 import pathlib
-import configparser
 
 import pandas as pd
-from datetime import datetime, time
-import numpy as np
+from datetime import datetime, timedelta, timezone
 import math
 import json
-import logging
-
-
-config = configparser.ConfigParser()
-config.read('config.ini')
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+import metrics
+import patch_rules
+import person_cache
+import person_index
+import photos
+import pure_api
+import stages
+import storage
+import settings
+
+
+config = settings.get_config()
 API_KEY_CRUD = config['Pure']['pure_api_key_crud']
 API_KEY_OLD = config['Pure']['pure_api_key_old']
 API_PP = config['PP']['api']
@@ -28,6 +39,20 @@ headers = {
     "content-type": "application/json"
 }
 UUSTAFF_MAX_FACULTY_NR = 25
+UUSTAFF_MAX_WORKERS = 8                         # pages fetched at the same time
+UUSTAFF_MAX_URL_LENGTH = 2000                    # longest url accepted by the staff pages api
+PURE_PERSONS_PAGE_SIZE = 1000                    # persons per page from the old Pure API
+PURE_PERSONS_MAX_WORKERS = 8                     # pages fetched at the same time
+PURE_PERSONS_FULL_SYNC_DAYS = 7                  # max days between two full syncs of active persons
+ACTIVE_PERSONS_SNAPSHOT_FILENAME = 'active_persons_snapshot.json'
+INPUT_FOR_PURE_FILENAME = 'input_for_pure2.ndjson'   # one person json per line
+PURE_SEARCH_CHUNK_SIZE = 50                      # uuids per persons/search request
+PURE_SEARCH_MAX_CHUNK_SIZE = 1000                # largest page the persons/search endpoint returns
+PURE_SEARCH_MAX_WORKERS = 4                      # search requests at the same time
+PURE_SEARCH_ATTEMPTS = 2                         # tries of a failing chunk before it is split
+# How long the cached output of each harvest stage stays valid, see harvest_stages().
+STAGE_TTL_HOURS = {'persons': 12, 'connect': 12, 'photos': 24}
+PERSON_CACHE_MAX_AGE_HOURS = STAGE_TTL_HOURS['persons']  # max age of the snapshot to trust the person cache
 UUSTAFF_HARVEST_FILENAME = config['PP']['filestaff']
 UUSTAFF_MAX_RECS_TO_HARVEST = 1000               # 0 = all records
 # We can harvest many fields from the UU staff pages. For now,
@@ -64,9 +89,6 @@ UUSTAFF_FACULTY_ENDPOINT = '/Public/GetEmployeesOrganogram?f='
 UUSTAFF_EMPLOYEE_ENDPOINT = '/Public/getEmployeeData?page='
 UUSTAFF_SOLISID_ENDPOINT = '/RestApi/getmedewerkers?selectie=solisid:'
 UUSTAFF_PHOTO_ENDPOINT = '/Public/GetImage?Employee='
-# Define the file path relative to the script's location
-project_root = os.path.dirname(os.path.dirname(__file__))  # Go up one level from src/
-files_dir = os.path.join(project_root, 'files')
 
 def timestamp(seconds: bool = False) -> str:
     """Get a timestamp only consisting of a time.
@@ -81,67 +103,80 @@ def timestamp(seconds: bool = False) -> str:
         time_stamp = now.strftime("%H:%M")
     return time_stamp
 
-def harvest_json_uustaffpages(url: str, max_recs_to_harvest: int = 0) -> list:
+def _get_uustaff_json(url: str, what: str) -> dict:
+    """Fetch one page from the UU staff pages API, stopping the script on an error.
+
+    :param url: The url to fetch.
+    :param what: Description of what is being harvested, used in the error message.
+    :return: the decoded json page.
+    """
+    response = http_client.get(url)
+    if response.status_code != requests.codes.ok:
+        print('harvest_json_uustaffpages(): error during harvest ' + what + '.')
+        print('Status code: ' + str(response.status_code))
+        print('Url: ' + response.url)
+        print('Error: ' + response.text)
+        exit(1)
+    return response.json()
+
+
+@metrics.timed_stage('harvest_json_uustaffpages')
+def harvest_json_uustaffpages(url: str, max_recs_to_harvest: int = 0,
+                              max_workers: int = UUSTAFF_MAX_WORKERS) -> list:
     """
     :param url: The base URL for harvesting data from the UU staff pages.
     :param max_recs_to_harvest: The maximum number of records to harvest. If set to 0, all available records will be harvested.
-    :return: A list of dictionaries containing the harvested employee data.
+    :param max_workers: The maximum number of pages fetched at the same time. Use 1 to harvest one page after another.
+    :return: A list of dictionaries containing the harvested employee data, in faculty and organogram order.
     """
-    print('Harvesting json data from ' + url + '.')
+    print('Harvesting json data from ' + url + ' with ' + str(max_workers) + ' workers.')
 
     all_records = 9999999999                # a large number
     if max_recs_to_harvest == 0:
         max_recs_to_harvest = all_records
-    json_data = []
-    count = 0
-    for faculty_nr in range(UUSTAFF_MAX_FACULTY_NR):
-        if count >= max_recs_to_harvest:
-            break
-        print('[faculty nr ' + str(faculty_nr) + ' at ' + timestamp() + ']')
-        # 'l-EN' ensures that phone numbers are preceded with "+31".
-        # 'fullresult=true' or '=false' only differ in 'Guid' field value.
-        faculty_url = url + UUSTAFF_FACULTY_ENDPOINT + str(faculty_nr) + '&l=EN&fullresult=true'
-        print (faculty_url)
-        faculty_response = requests.get(faculty_url)
-        if faculty_response.status_code != requests.codes.ok:
-            print('harvest_json_uustaffpages(): error during harvest faculties.')
-            print('Status code: ' + str(faculty_response.status_code))
-            print('Url: ' + faculty_response.url)
-            print('Error: ' + faculty_response.text)
-            exit(1)
-        faculty_page = faculty_response.json()
-        if 'Employees' not in faculty_page:
-            # Empty faculty.
-            continue
-        if len(faculty_page['Employees']) == 0:
-            # Empty faculty.
-            continue
 
-        df_employees = pd.DataFrame(faculty_page['Employees'])
-        df_employees_url = df_employees['Url']
-        df_employees_url.dropna(axis=0, how='any', inplace=True)
-        if df_employees_url is None:
-            # Nothing found.
-            continue
+    # 'l-EN' ensures that phone numbers are preceded with "+31".
+    # 'fullresult=true' or '=false' only differ in 'Guid' field value.
+    faculty_urls = [url + UUSTAFF_FACULTY_ENDPOINT + str(faculty_nr) + '&l=EN&fullresult=true'
+                    for faculty_nr in range(UUSTAFF_MAX_FACULTY_NR)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map() returns the pages in the order of faculty_urls, which
+        # keeps the result deterministic regardless of which request finishes first.
+        faculty_pages = executor.map(lambda faculty_url: _get_uustaff_json(faculty_url, 'faculties'),
+                                     faculty_urls)
 
-        employees_of_faculty = list(df_employees_url)
-        for employee_id in employees_of_faculty:
-            if count >= max_recs_to_harvest:
+        employee_ids = []
+        for faculty_nr, faculty_page in enumerate(faculty_pages):
+            if len(employee_ids) >= max_recs_to_harvest:
                 break
-            employee_url = url + UUSTAFF_EMPLOYEE_ENDPOINT + employee_id + '&l=EN'
+            print('[faculty nr ' + str(faculty_nr) + ' at ' + timestamp() + ']')
+            if 'Employees' not in faculty_page:
+                # Empty faculty.
+                continue
+            if len(faculty_page['Employees']) == 0:
+                # Empty faculty.
+                continue
+
+            df_employees = pd.DataFrame(faculty_page['Employees'])
+            df_employees_url = df_employees['Url']
+            df_employees_url.dropna(axis=0, how='any', inplace=True)
+            if df_employees_url is None:
+                # Nothing found.
+                continue
+            employee_ids.extend(df_employees_url)
 
-            employee_response = requests.get(employee_url)
-            if employee_response.status_code != requests.codes.ok:
-                print('harvest_json_uustaffpages(): error during harvest employees.')
-                print('Status code: ' + str(employee_response.status_code))
-                print('Url: ' + employee_response.url)
-                print('Error: ' + employee_response.text)
-                exit(1)
-            employee_page = employee_response.json()
+        employee_ids = employee_ids[:max_recs_to_harvest]
+        employee_urls = [url + UUSTAFF_EMPLOYEE_ENDPOINT + employee_id + '&l=EN'
+                         for employee_id in employee_ids]
+        employee_pages = executor.map(lambda employee_url: _get_uustaff_json(employee_url, 'employees'),
+                                      employee_urls)
 
+        json_data = []
+        count = 0
+        for employee_id, employee_page in zip(employee_ids, employee_pages):
             if 'Employee' in employee_page:
                 parse = {}
-                # print(employee_page)
                 parse['Employee_Id'] = employee_id
                 for element in UUSTAFF_FIELDS_TO_HARVEST:
 
@@ -181,559 +216,559 @@ def datetimestamp(seconds: bool = False) -> str:
 
 def harvest_json_and_write_to_file_uustaffpages(filename: str,
                                                 url: str,
-                                                max_recs_to_harvest: int = 0) -> list:
+                                                max_recs_to_harvest: int = 0,
+                                                max_workers: int = UUSTAFF_MAX_WORKERS) -> list:
     """
     :param filename: Path to the file where the JSON data will be written.
     :param url: URL from which the JSON data is harvested.
     :param max_recs_to_harvest: Maximum number of records to harvest from the URL. Defaults to 0, which means no limit.
+    :param max_workers: Maximum number of pages fetched at the same time.
     :return: List of JSON objects harvested from the URL.
     """
     print('STEP 1: Harvest profile page information')
     json_data = harvest_json_uustaffpages(url=url,
-                                          max_recs_to_harvest=max_recs_to_harvest)
+                                          max_recs_to_harvest=max_recs_to_harvest,
+                                          max_workers=max_workers)
 
     if len(json_data) == 0:
         return []
 
 
     # Ensure the 'files' directory exists
-    os.makedirs(files_dir, exist_ok=True)
-    json_path = os.path.join(files_dir, filename)
+    os.makedirs(settings.files_dir, exist_ok=True)
+    json_path = os.path.join(settings.files_dir, filename)
     # Save JSON
     with open(json_path, 'w') as json_file:
         json.dump(json_data, json_file, indent=4)
     return json_data
 
 
-def connect_pure_with_uustaffpages(url, solislist):
+def _solis_batches(url: str, solislist: list, max_url_length: int) -> list:
+    """
+    Group the SolisIDs into batches that are as large as possible while the request
+    url stays within max_url_length.
+
+    :param url: The base URL for the UU staff pages API endpoint.
+    :param solislist: A list of dictionaries, each containing `employee_id` and `uuid`.
+    :param max_url_length: The longest url the endpoint accepts.
+    :return: A list of lists of employee ids.
+    """
+    base_length = len(url + UUSTAFF_SOLISID_ENDPOINT)
+    batches = []
+    batch = []
+    url_length = base_length
+    for solis in solislist:
+        employee_id = solis['employee_id']
+        # Every id after the first one is preceded by a comma.
+        id_length = len(employee_id) + (1 if batch else 0)
+        if batch and url_length + id_length > max_url_length:
+            batches.append(batch)
+            batch = []
+            url_length = base_length
+            id_length = len(employee_id)
+        batch.append(employee_id)
+        url_length += id_length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _get_solis_pages(url: str, batch: list) -> list:
+    """
+    :param url: The base URL for the UU staff pages API endpoint.
+    :param batch: A list of employee ids.
+    :return: The staff pages found for the employee ids. If the endpoint refuses the url
+             because it is too long, the batch is split in two and both halves are requested.
+    """
+    solis_url = f"{url}{UUSTAFF_SOLISID_ENDPOINT}{','.join(batch)}"
+    response = http_client.get(solis_url)
+    if response.status_code in (requests.codes.bad_request, requests.codes.not_found,
+                                requests.codes.request_uri_too_large) and len(batch) > 1:
+        print('connect_pure_with_uustaffpages(): url of ' + str(len(solis_url))
+              + ' characters refused, consider lowering UUSTAFF_MAX_URL_LENGTH.')
+        half = len(batch) // 2
+        return _get_solis_pages(url, batch[:half]) + _get_solis_pages(url, batch[half:])
+    if response.status_code != requests.codes.ok:
+        print('connect_pure_with_uustaffpages(): error during batch request.')
+        print('Status code: ' + str(response.status_code))
+        print('Url: ' + response.url)
+        print('Error: ' + response.text)
+        exit(1)
+    return response.json() or []
+
+
+@metrics.timed_stage('connect_pure_with_uustaffpages')
+def connect_pure_with_uustaffpages(url, solislist,
+                                   max_url_length: int = UUSTAFF_MAX_URL_LENGTH,
+                                   max_workers: int = UUSTAFF_MAX_WORKERS):
     """
     :param url: The base URL for the UU staff pages API endpoint.
     :param solislist: A list of dictionaries, where each dictionary contains `employee_id` and `uuid` of individuals.
+    :param max_url_length: The longest url the endpoint accepts, this determines the number of SolisIDs per request.
+    :param max_workers: The maximum number of batches requested at the same time.
     :return: A pandas DataFrame containing the parsed and consolidated data of SolisIDs and corresponding UU staff pages information.
     """
+    solis_batches = _solis_batches(url, solislist, max_url_length)
     print('STEP 3: Connect Pure SolisIDs with corresponding persons from UU staff pages from ' + url + UUSTAFF_SOLISID_ENDPOINT
-         + ' in batches of 50...')
-    parse_result = pd.DataFrame()
-    parse_chunk = []  # List of dictionaries for parsed results
-    batch_size = 50  # Number of SolisIDs to process in a single request
-
-    # Group the SolisIDs into batches of `batch_size`
-    solis_batches = [solislist[i:i + batch_size] for i in range(0, len(solislist), batch_size)]
+          + ' in ' + str(len(solis_batches)) + ' batches...')
 
-    for batch_index, batch in enumerate(solis_batches, start=1):
+    # Index the uuids once on the upper-cased employee id, the staff pages return
+    # SolisIDs in upper case. The first uuid wins if an employee id occurs twice.
+    uuid_by_solis_id = {}
+    for solis in solislist:
+        uuid_by_solis_id.setdefault(solis['employee_id'].upper(), solis['uuid'])
 
-        solis_ids = ",".join(solis['employee_id'] for solis in batch)
-        solis_url = f"{url}{UUSTAFF_SOLISID_ENDPOINT}{solis_ids}"
-
-
-        response = requests.get(solis_url)
-        if response.status_code != requests.codes.ok:
-            print('connect_pure_with_uustaffpages(): error during batch request.')
-            print('Status code: ' + str(response.status_code))
-            print('Url: ' + response.url)
-            print('Error: ' + response.text)
-            exit(1)
-
-        pages = response.json()
-        if not pages:
-            continue
-
-        for page in pages:
-            solis_id = (page.get('SolisID') or '').upper()
-            if not solis_id:
-                continue
+    parse_chunk = []  # List of dictionaries for parsed results
+    seen_lines = set()
+    count = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map() returns the batches in order, so the result does not
+        # depend on which request finishes first.
+        for batch, pages in zip(solis_batches,
+                                executor.map(lambda batch: _get_solis_pages(url, batch), solis_batches)):
+            for page in pages:
+                solis_id = (page.get('SolisID') or '').upper()
+                if not solis_id:
+                    continue
+
+                uustaff_page_url = page.get('UrlEN') or page.get('UrlNL', '')
+                if not uustaff_page_url:
+                    continue
+
+                path = pathlib.PurePath(uustaff_page_url)
+                solis_uuid = uuid_by_solis_id.get(solis_id)
+
+                parse_line = {
+                    'SOLIS_ID': str(solis_id),
+                    'UUID': str(solis_uuid) if solis_uuid else '',
+                    # A null on the staff pages is missing, not the text 'None'.
+                    'Email': str(page.get('Email') or ''),
+                    'DescriptionEN': str(page.get('DescriptionEN') or ''),
+                    'DescriptionNL': str(page.get('DescriptionNL') or ''),
+                    'UrlProfielfoto': str(page.get('UrlProfielfoto') or ''),
+                    'UrlEN': str(page.get('UrlEN') or ''),
+                    'ToestemmingProfielfotoInExterneApps': page.get('ToestemmingProfielfotoInExterneApps'),
+                    'UUSTAFF_PAGE_ID': str(path.name)
+                }
 
-            uustaff_page_url = page.get('UrlEN') or page.get('UrlNL', '')
-            if not uustaff_page_url:
-                continue
-
-            path = pathlib.PurePath(uustaff_page_url)
-            solis_uuid = next((solis['uuid'] for solis in batch if solis['employee_id'] == solis_id), None)
-
-            parse_line = {
-                'SOLIS_ID': str(solis_id),
-                'UUID': str(solis_uuid) if solis_uuid else '',
-                'Email': str(page.get('Email', '')),
-                'DescriptionEN': str(page.get('DescriptionEN', '')),
-                'DescriptionNL': str(page.get('DescriptionNL', '')),
-                'UrlProfielfoto': str(page.get('UrlProfielfoto', '')),
-                'UrlEN': str(page.get('UrlEN', '')),
-                'ToestemmingProfielfotoInExterneApps': str(page.get('ToestemmingProfielfotoInExterneApps', '')),
-                'UUSTAFF_PAGE_ID': str(path.name)
-            }
-
-            parse_chunk.append(parse_line)
-
-        # print(f'Batch {batch_index} processed at ' + timestamp())
-        count  = batch_index * 50
-        print(count, '(' + timestamp() + ')  ', end='', flush=True)
-        if count % 500 == 0:
-            print('\n', end='', flush=True)
+                # Keep the first of identical lines, like drop_duplicates(keep='first').
+                line_key = tuple(parse_line.values())
+                if line_key in seen_lines:
+                    continue
+                seen_lines.add(line_key)
+                parse_chunk.append(parse_line)
 
+            previous_count = count
+            count += len(batch)
+            print(count, '(' + timestamp() + ')  ', end='', flush=True)
+            if count // 500 != previous_count // 500:
+                print('\n', end='', flush=True)
 
     print('\n', end='', flush=True)
 
-    parse_chunk_df = pd.DataFrame(parse_chunk)
-    parse_result = pd.concat([parse_result, parse_chunk_df], ignore_index=True)
-    parse_result.dropna(axis=0, how='all', inplace=True)
-    parse_result.drop_duplicates(keep='first', inplace=True, ignore_index=True)
+    parse_result = storage.coerce(pd.DataFrame(parse_chunk), storage.UUSTAFF_RESULTS_SCHEMA)
     print('Done at ' + timestamp() + '.\n')
     return parse_result
 
 
-def persons_active():
+def _get_active_persons_page(page: int, page_size: int, query: str = '') -> dict:
     """
-       Fetches and returns a list of active persons from the research portal API.
-       The function iteratively requests paginated data from the API and extracts
-       the 'uuid' and 'employee_id' for each person if both are available.
-
-       :return: A list of dictionaries, each containing 'uuid' and 'employee_id'.
-       """
-
-    print('STEP 2: Harvest active persons in Pure')
-    print(f'Harvesting active persons from {URL_PERSONS_OLD}')
-    count = 0
-    page_size = 20
-    page = 1
-    all_data = []
+    :param page: The number of the page to fetch, starting at 1.
+    :param page_size: The number of persons per page.
+    :param query: Extra query string appended to the request url.
+    :return: The decoded json page of active persons from the old Pure API.
+    """
+    request_url = f"{URL_PERSONS_OLD}?pageSize={page_size}&page={page}&apiKey={API_KEY_OLD}{query}"
     # Add headers with 'Accept: application/json'
-    headers = {
-        'Accept': 'application/json'
-    }
-    while True:
-        # Prepare the request URL with the current page
+    response = http_client.get(request_url, headers={'Accept': 'application/json'})
+    response.raise_for_status()  # Will raise an error if the request fails
+    return response.json()
 
-        request_url = f"{URL_PERSONS_OLD}?pageSize={page_size}&page={page}&apiKey={API_KEY_OLD}"
 
-        # Make the GET request
-        response = requests.get(request_url, headers=headers)
-        response.raise_for_status()  # Will raise an error if the request fails
+def _employee_id_of(person: dict):
+    """
+    :param person: A person item from the old Pure API.
+    :return: The value of the 'Employee ID' identifier of the person, or None if it has none.
+    """
+    # Search for employee ID in the 'ids' list
+    for identifier in person.get('ids', []):
+        # Check if the ID type is 'Employee ID'
+        id_type = identifier.get('type', {}).get('term', {}).get('text', [])
+        if any(entry.get('value') == 'Employee ID' for entry in id_type):
+            return identifier.get('value', {}).get('value')
+    return None
 
-        # Parse the JSON response
-        data = response.json()
-        # Extract the items from the response
-        items = data.get('items', [])
-        # Check if there are any items
-        if not items:
-            break
 
-        for person in items:
-            uuid = person.get('uuid')
-            employee_id = None
-            count += 1
-            if count % 50 == 0:
-                print(count, '(' + timestamp() + ')  ', end='', flush=True)
-            if count % 500 == 0:
-                print('\n', end='', flush=True)
-            # Search for employee ID in the 'ids' list
-            ids_list = person.get('ids', [])
-            for identifier in ids_list:
-                # Check if the ID type is 'Employee ID'
-                id_type = identifier.get('type', {}).get('term', {}).get('text', [])
-                if any(entry.get('value') == 'Employee ID' for entry in id_type):
-                    employee_id = identifier.get('value', {}).get('value')
-                    break
-
-            # Append the UUID and Employee ID if both are found
-            if uuid and employee_id:
-                all_data.append({'uuid': uuid, 'employee_id': employee_id})
+def _fetch_active_persons(page_size: int, max_workers: int, query: str = '') -> tuple:
+    """
+    :param page_size: The number of persons requested per page.
+    :param max_workers: The maximum number of pages fetched at the same time.
+    :param query: Extra query string appended to every page request, e.g. a modification date filter.
+    :return: A tuple of all person items from the old Pure API, in page order, and whether the
+             listing is complete: False if fewer persons were received than the count Pure reported.
+    """
+    def get_page(page):
+        return _get_active_persons_page(page, page_size, query)
+
+    first_page = get_page(1)
+    pages = [first_page.get('items', [])]
+    count = first_page.get('count')
+    # Pure may cap the page size: then pages are numbered by the size it actually returns.
+    served_page_size = len(pages[0]) if count and 0 < len(pages[0]) < min(count, page_size) else page_size
+    nr_of_pages = math.ceil((count or 0) / served_page_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for data in executor.map(get_page, range(2, nr_of_pages + 1)):
+            pages.append(data.get('items', []))
+
+    # Persons may have been added while paging, or Pure may not have returned
+    # a count at all: continue one page at a time until an empty page is found.
+    while pages[-1] and len(pages[-1]) >= served_page_size:
+        pages.append(get_page(len(pages) + 1).get('items', []))
+
+    items = [person for page_items in pages for person in page_items]
+    is_complete = count is None or len(items) >= count
+    if not is_complete:
+        print(f'Warning: Pure reported {count} persons, but only {len(items)} were received')
+    return items, is_complete
+
+
+def _person_hash(person: dict) -> str:
+    """
+    :param person: A person item from the old Pure API.
+    :return: A hash of the complete content of the person item.
+    """
+    return hashlib.sha1(json.dumps(person, sort_keys=True).encode('utf-8')).hexdigest()
 
-        page += 1
 
+def load_active_persons_snapshot() -> dict:
+    """
+    :return: The snapshot of active persons from the last successful sync, or an empty
+             snapshot if there is none. 'persons' maps every uuid to its 'employee_id',
+             content 'hash' and Pure 'modified' date.
+    """
+    snapshot_path = os.path.join(settings.files_dir, ACTIVE_PERSONS_SNAPSHOT_FILENAME)
+    try:
+        with open(snapshot_path, 'r') as snapshot_file:
+            return json.load(snapshot_file)
+    except FileNotFoundError:
+        return {'last_sync': None, 'last_full_sync': None, 'changed_uuids': [], 'persons': {}}
 
-        # for testing
-        # if page >20:
-        #     break
 
+def _parse_sync_time(value: str) -> datetime:
+    """
+    :param value: A sync time from the snapshot, in ISO format.
+    :return: The time with its UTC offset. Snapshots written before the offset was stored hold
+             local times, those are taken as local time.
+    """
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo is not None else parsed.astimezone()
 
-    df_path = os.path.join(files_dir, 'active_persons.csv')
-    # Convert list of dictionaries to a DataFrame
-    df = pd.DataFrame(all_data)
 
-    # Save DataFrame to CSV
-    df.to_csv(df_path, index=False)
-    print('end fetching active persons from pure')
-    return all_data
+def _save_active_persons_snapshot(snapshot: dict):
+    """Write the snapshot to a temporary file first, so an interrupted run keeps the previous one."""
+    os.makedirs(settings.files_dir, exist_ok=True)
+    snapshot_path = os.path.join(settings.files_dir, ACTIVE_PERSONS_SNAPSHOT_FILENAME)
+    with open(snapshot_path + '.tmp', 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.replace(snapshot_path + '.tmp', snapshot_path)
 
 
-def dowload_profilepictures(parsed_results):
+@metrics.timed_stage('persons_active')
+def persons_active(page_size: int = PURE_PERSONS_PAGE_SIZE,
+                   max_workers: int = PURE_PERSONS_MAX_WORKERS,
+                   full_sync: bool = False):
+    """
+       Fetches and returns a list of active persons from the research portal API.
+       The first page tells how many persons there are, the remaining pages are
+       then requested concurrently and merged in page order. For each person the
+       'uuid' and 'employee_id' are extracted if both are available.
+
+       The result is kept in a local snapshot keyed by uuid. Unless a full sync is
+       requested, only the changes since the last successful sync are applied to it:
+       - if 'persons_modified_after_param' is set in the [Pure] section of config.ini,
+         only persons modified since the last sync are requested from Pure. Persons
+         that are no longer active cannot be seen this way, so a full sync is done
+         anyway when the last one is older than PURE_PERSONS_FULL_SYNC_DAYS;
+       - otherwise all persons are requested, and only those whose content hash
+         differs from the snapshot are parsed again.
+
+       :param page_size: The number of persons requested per page.
+       :param max_workers: The maximum number of pages fetched at the same time.
+       :param full_sync: If True, ignore the snapshot and rebuild it from all active persons.
+       :return: A list of dictionaries, each containing 'uuid' and 'employee_id'.
+       """
 
+    print('STEP 2: Harvest active persons in Pure')
+    # In UTC and with the offset, so Pure cannot read the modification date filter in another time zone.
+    sync_started = datetime.now(timezone.utc).replace(microsecond=0)
+    snapshot = load_active_persons_snapshot()
+    modified_after_param = config.get('Pure', 'persons_modified_after_param', fallback='')
+    last_full_sync = snapshot['last_full_sync']
+    if last_full_sync is None or \
+            sync_started - _parse_sync_time(last_full_sync) > timedelta(days=PURE_PERSONS_FULL_SYNC_DAYS):
+        full_sync = True
+
+    if full_sync:
+        print(f'Harvesting all active persons from {URL_PERSONS_OLD}')
+        persons = {}
+    else:
+        persons = snapshot['persons']
+
+    if modified_after_param and not full_sync:
+        modified_after = _parse_sync_time(snapshot['last_sync']).isoformat()
+        print(f"Harvesting active persons modified since {modified_after} from {URL_PERSONS_OLD}")
+        query = '&' + modified_after_param + '=' + urllib.parse.quote(modified_after)
+        items, _ = _fetch_active_persons(page_size, max_workers, query)
+        is_complete_listing = False
+    else:
+        if not full_sync:
+            print(f'Harvesting active persons from {URL_PERSONS_OLD}, comparing them with the snapshot')
+        # Only a listing with every person Pure counted tells which persons are no longer active.
+        items, is_complete_listing = _fetch_active_persons(page_size, max_workers)
 
-    # Define the file path relative to the script's location
-    print('STEP 4: start downloading profile pictures from PP')
-    project_root = os.path.dirname(os.path.dirname(__file__))  # Go up one level from src/
-    files_dir = os.path.join(project_root, 'files')
-    # json_path = os.path.join(files_dir, 'filesuustaff_harvest.json')
-    # # Load JSON data from file
-    # try:
-    #     with open(json_path, 'r') as json_file:
-    #         uustaff = json.load(json_file)
-    #     # print(f"Data read from JSON: {uustaff}")
-    # except FileNotFoundError:
-    #     print(f"File not found: {json_path}")
-    # except json.JSONDecodeError as e:
-    #     print(f"Error decoding JSON: {e}")
-    # file_path = "uustaff_harvest.json"
-    #
-    # # Convert JSON data to a DataFrame
-    # json_df = pd.DataFrame(uustaff)
-    #
-    # # Rename the 'Employee_Id' column in json_df to match the 'UUSTAFF_PAGE_ID' column in the existing DataFrame
-    # json_df.rename(columns={'Employee_Id': 'UUSTAFF_PAGE_ID'}, inplace=True)
-    #
-    # # Merge the two DataFrames on 'UUSTAFF_PAGE_ID'
-    #
-    # merged_df = parsed_results.merge(json_df, on='UUSTAFF_PAGE_ID', how='left')
-    # # Define the path where the merged DataFrame should be saved
-    output_path = os.path.join(files_dir, 'uustaff_results.csv')
-
-    # Save the merged DataFrame as a CSV file
-    parsed_results.to_csv(output_path, index=False)
-
-    # Merge the two DataFrames on 'UUSTAFF_PAGE_ID'
-    # df = parsed_results.merge(json_df, on='UUSTAFF_PAGE_ID', how='left')
-    project_root = os.path.dirname(os.path.dirname(__file__))  # Go up one level from src/
-    photos_dir = os.path.join(project_root, 'photos')
-    # Ensure the 'photos' directory exists
-    os.makedirs(photos_dir, exist_ok=True)
-    photodf = parsed_results[parsed_results['ToestemmingProfielfotoInExterneApps'] != 'False']
     count = 0
-    for index, row in photodf.iterrows():
-        url = row['UrlProfielfoto']
+    changed_uuids = []
+    listed_uuids = set()
+    for person in items:
+        uuid = person.get('uuid')
         count += 1
         if count % 50 == 0:
             print(count, '(' + timestamp() + ')  ', end='', flush=True)
         if count % 500 == 0:
             print('\n', end='', flush=True)
+        # A person can show up twice when the population shifts between two pages.
+        if not uuid or uuid in listed_uuids:
+            continue
+        listed_uuids.add(uuid)
 
-        if url:  # Check if the URL is not None or empty
-            # Send a GET request to the URL
-            response = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
-
-            # Check if the request was successful
-            if response.status_code == 200:
-                # Construct the full path for the image file
-                filename = os.path.join(photos_dir, f"{row['UUSTAFF_PAGE_ID']}.jpg")
-
-                # Save the image content to a file
-                with open(filename, "wb") as file:
-                    file.write(response.content)
-                # print(f"Image downloaded successfully: {filename}")
-            else:
-                print(f"Failed to download image for {row['UUSTAFF_PAGE_ID']}. Status code: {response.status_code}")
-        # else:
-        #     # print(f"No URL found for {row['UUSTAFF_PAGE_ID']}")
-    print('End downloading profile pictures from PP')
-    return parsed_results
+        person_hash = _person_hash(person)
+        known_person = persons.get(uuid)
+        if known_person is not None and known_person['hash'] == person_hash:
+            continue
+        persons[uuid] = {
+            'employee_id': _employee_id_of(person),
+            'hash': person_hash,
+            'modified': person.get('info', {}).get('modifiedDate'),
+        }
+        changed_uuids.append(uuid)
+
+    if is_complete_listing:
+        # Persons missing from a complete listing are no longer active.
+        for uuid in [uuid for uuid in persons if uuid not in listed_uuids]:
+            del persons[uuid]
+            changed_uuids.append(uuid)
+    elif full_sync:
+        # Keep the persons Pure did not list this time, and do the full sync again next run.
+        for uuid, person in snapshot['persons'].items():
+            persons.setdefault(uuid, person)
+    print('\n' + str(len(changed_uuids)) + ' active persons added, changed or removed.')
+
+    snapshot['persons'] = persons
+    snapshot['changed_uuids'] = changed_uuids
+    snapshot['last_sync'] = sync_started.isoformat()
+    if full_sync and is_complete_listing:
+        snapshot['last_full_sync'] = sync_started.isoformat()
+    _save_active_persons_snapshot(snapshot)
+
+    # Append the UUID and Employee ID if both are found
+    all_data = [{'uuid': uuid, 'employee_id': person['employee_id']}
+                for uuid, person in persons.items() if person['employee_id']]
+
+    # Convert list of dictionaries to a DataFrame and save it with its types
+    storage.write_table(pd.DataFrame(all_data), storage.table_path('active_persons'),
+                        storage.ACTIVE_PERSONS_SCHEMA)
+    print('end fetching active persons from pure')
+    return all_data
 
 
-def fetch_person_data(merged_df):
+@metrics.timed_stage('dowload_profilepictures')
+def dowload_profilepictures(parsed_results, max_workers: int = photos.PHOTOS_MAX_WORKERS):
     """
-       :param merged_df: Pandas DataFrame containing a column of UUIDs.
-       :param api_key: String representing the API key for authorization.
-       :return: Dictionary containing combined results from all API requests.
-       """
-    print('STEP 5: harvesting the personjsons from pure via the crud api')
-
-    # Function to create chunks of a list
-    def chunks(lst, n):
-        """Yield successive n-sized chunks from lst."""
-        for i in range(0, len(lst), n):
-            yield lst[i:i + n]
-
+    :param parsed_results: A DataFrame with the persons from the UU staff pages, as returned by connect_pure_with_uustaffpages().
+    :param max_workers: The maximum number of photos downloaded at the same time.
+    :return: The same DataFrame, after saving it as the uustaff_results table and downloading the profile pictures
+             of the persons who gave consent. Photos that did not change since the last run are skipped.
+    """
+    print('STEP 4: start downloading profile pictures from PP')
+    # Save the merged DataFrame with its types, for update_pure.py
+    storage.write_table(parsed_results, storage.table_path('uustaff_results'), storage.UUSTAFF_RESULTS_SCHEMA)
+    # And index it on SOLIS_ID and UUID, for updating a single person
+    person_index.build_index(parsed_results)
+
+    # Skip only the persons that refused, like before when the consent is unknown.
+    consent = parsed_results['ToestemmingProfielfotoInExterneApps'].astype('boolean')
+    photodf = parsed_results[consent.ne(False).fillna(True).astype(bool)]
+    # Only rows with a url, skip None or empty values
+    photodf = photodf[photodf['UrlProfielfoto'].fillna('') != '']
+    downloaded = photos.download_photos(list(zip(photodf['UUSTAFF_PAGE_ID'], photodf['UrlProfielfoto'])),
+                                        max_workers=max_workers)
+
+    # Normalize new photos and encode them for Pure now, rather than per person during the update.
+    downloaded = set(downloaded)
+    photos.prepare_photos([page_id for page_id in photodf['UUSTAFF_PAGE_ID']
+                           if page_id in downloaded or (os.path.exists(photos.photo_path(page_id))
+                                                        and not os.path.exists(photos.payload_path(page_id)))])
+    print('End downloading profile pictures from PP')
+    return parsed_results
 
-    # Extract UUIDs from the DataFrame
-    uuids = merged_df['UUID'].tolist()
 
-    # Split the UUIDs into chunks of 50
-    uuid_chunks = list(chunks(uuids, 50))
+def _is_rejected_request(error) -> bool:
+    """
+    :param error: The exception raised by a request.
+    :return: True if Pure rejected the request itself, with a 4xx status other than 429, which a
+             uuid in the request can cause. Not for server errors, timeouts or connection errors.
+    """
+    response = getattr(error, 'response', None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
 
-    # List to store all the results
-    all_results = []
-    all_items = []
-    count = 0
-    # Loop through each chunk and make the POST request
-    for chunk in uuid_chunks:
-        count += 1
-        if count % 50 == 0:
-            print(count, '(' + timestamp() + ')  ', end='', flush=True)
-        if count % 500 == 0:
-            print('\n', end='', flush=True)
-        # Prepare the payload
-        payload = {
-            "uuids": chunk,
-            "size": 100,
-            "offset": 0
-        }
 
-        # Make the POST request
+def search_persons_resilient(uuids, attempts: int = PURE_SEARCH_ATTEMPTS):
+    """
+    Search persons like pure_api.search_persons(), but retry a failing chunk. If Pure rejects the
+    request, split the chunk in halves until the uuids that make it fail are isolated. If Pure or
+    the network fails, the whole chunk fails: splitting would only multiply the requests during an
+    outage, each retried by http_client.
+
+    :param uuids: A list of uuids.
+    :param attempts: The number of times a chunk is requested before it fails or is split.
+    :return: A tuple of the Pure json of the persons found and the list of uuids that could not be requested.
+    """
+    for attempt in range(attempts):
         try:
-
-            response = requests.post(URL_PERSONS_NEW_SEARCH, headers=headers, json=payload)
-            response.raise_for_status()  # Raise an error if the request fails
+            return pure_api.search_persons(uuids), []
         except requests.exceptions.RequestException as e:
-            print(f"An error occurred: {e}")
-            continue
-            # Extract the items from the JSON response
-        response_json = response.json()
+            error = e
+            if _is_rejected_request(e):
+                break  # Another try gets the same answer.
+    if len(uuids) == 1:
+        print(f"An error occurred for {uuids[0]}: {error}")
+        return [], list(uuids)
+    if not _is_rejected_request(error):
+        print(f"An error occurred for a chunk of {len(uuids)} uuids, from {uuids[0]}: {error}")
+        return [], list(uuids)
+    half = len(uuids) // 2
+    first_items, first_failed = search_persons_resilient(uuids[:half], attempts)
+    second_items, second_failed = search_persons_resilient(uuids[half:], attempts)
+    return first_items + second_items, first_failed + second_failed
+
+
+def person_modified_dates() -> dict:
+    """
+    :return: The Pure modification date of every active person, by uuid, from the snapshot of
+             active persons. Empty if the snapshot is older than 'person_cache_max_age_hours' in the
+             [Pure] section of config.ini (PERSON_CACHE_MAX_AGE_HOURS), so it cannot vouch for the cache.
+    """
+    snapshot = load_active_persons_snapshot()
+    max_age = config.getfloat('Pure', 'person_cache_max_age_hours', fallback=PERSON_CACHE_MAX_AGE_HOURS)
+    if snapshot['last_sync'] is None or \
+            datetime.now(timezone.utc) - _parse_sync_time(snapshot['last_sync']) > timedelta(hours=max_age):
+        return {}
+    return {uuid: person.get('modified') for uuid, person in snapshot['persons'].items()}
 
-        items = response_json.get("items", [])
-        all_items.extend(items)
 
-    # Combine all results into a single dictionary
-    combined_results = {
-        "results": all_items
+def iter_person_chunks(uuids, chunk_size: int = None, max_workers: int = PURE_SEARCH_MAX_WORKERS,
+                       use_cache: bool = True):
+    """
+    :param uuids: A list of uuids.
+    :param chunk_size: The number of uuids per request, defaults to 'search_chunk_size' in the [Pure]
+                       section of config.ini or PURE_SEARCH_CHUNK_SIZE, and is at most PURE_SEARCH_MAX_CHUNK_SIZE.
+    :param max_workers: The maximum number of chunks requested at the same time.
+    :param use_cache: If True, take the persons that were not modified in Pure since they were last
+                      fetched from the local cache, see person_cache.PersonCache, and fetch only the others.
+                      Otherwise fetch all persons, and only store them in the cache.
+                      A cached person may have been edited in Pure after the snapshot of active persons,
+                      so fetch it again before it is written, see pipeline.stream_update().
+    :return: A generator of (requested uuids, Pure json of the persons found, uuids that failed, whether the
+             persons come from the cache) per chunk, the cached persons first and then the fetched ones in
+             order. Only max_workers chunks are fetched ahead of the consumer.
+    """
+    if chunk_size is None:
+        chunk_size = config.getint('Pure', 'search_chunk_size', fallback=PURE_SEARCH_CHUNK_SIZE)
+    chunk_size = max(1, min(chunk_size, PURE_SEARCH_MAX_CHUNK_SIZE))
+    modified_by_uuid = person_modified_dates()
+    with person_cache.PersonCache() as cache:
+        # The fetched persons are stored either way, so a later run can use them.
+        valid_uuids = cache.valid_uuids(modified_by_uuid) if use_cache else set()
+        cached_uuids = [uuid for uuid in uuids if uuid in valid_uuids]
+        uuids = [uuid for uuid in uuids if uuid not in valid_uuids]
+        print(f'{len(cached_uuids)} persons from the local cache, {len(uuids)} to fetch from Pure')
+        for i in range(0, len(cached_uuids), chunk_size):
+            chunk = cached_uuids[i:i + chunk_size]
+            yield chunk, cache.get(chunk), [], True
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            window = collections.deque()
+            for i in range(0, len(uuids), chunk_size):
+                chunk = uuids[i:i + chunk_size]
+                window.append((chunk, executor.submit(search_persons_resilient, chunk)))
+                if len(window) >= max_workers:
+                    chunk, future = window.popleft()
+                    items, failed = future.result()
+                    # Store the persons before the consumer modifies them.
+                    cache.store(items, modified_by_uuid)
+                    yield chunk, items, failed, False
+            while window:
+                chunk, future = window.popleft()
+                items, failed = future.result()
+                cache.store(items, modified_by_uuid)
+                yield chunk, items, failed, False
+
+
+def completeness_report(requested: int, received_uuids, failed_uuids) -> dict:
+    """
+    :param requested: The number of uuids requested from Pure.
+    :param received_uuids: The uuids of the persons Pure returned.
+    :param failed_uuids: The uuids that could not be requested, see search_persons_resilient().
+    :return: A report with the number of uuids 'requested', 'received', 'failed' and 'missing'
+             (requested without error but not returned, e.g. deleted in Pure), and the 'failed_uuids'.
+    """
+    received = len(set(received_uuids))
+    report = {
+        'requested': requested,
+        'received': received,
+        'failed': len(failed_uuids),
+        'missing': requested - received - len(failed_uuids),
+        'failed_uuids': list(failed_uuids),
     }
-    return combined_results
-
-def modify_profile_photo(data, name):
-    """
-    :param data: A dictionary containing profile information where the new photo data will be added.
-    :param name: A string used for naming the profile photo. Takes only the first character of the string to generate the photo's file name.
-    :return: None. Modifies the input data dictionary in place by adding a new profile photo if the corresponding image file exists.
-    """
-    # name = name[0]
-    # Define project root and photos directory
-    project_root = os.path.dirname(os.path.dirname(__file__))  # Go up one level from src/
-    photos_dir = os.path.join(project_root, 'photos')
-
-    image_path = os.path.join(photos_dir, f"{name}.jpg")
-
-    if os.path.exists(image_path):
-        with open(image_path, 'rb') as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-            # Prepare the payload
-            new_profile_photo = {
-                "fileName": "profilepicture.jpg",
-                "mimeType": "image/jpeg",
-                "size": 102400,  # Size in bytes (should be <= 1MB)
-                "fileData": encoded_image,
-                "copyrightConfirmation": True,
-                "type": {
-                    "uri": "/dk/atira/pure/person/personfiles/portrait",
-                    "term": {
-                        "en_GB": "Portrait"
-                    }
-                },
-                "caption": {
-                    "en": "Profile photo"
-                },
-                "altText": {
-                    "en": "A profile picture"
-                },
-                "copyrightStatement": {
-                    "en": "© 2024 by User"
-                }
-            }
-            if 'profilePhotos' not in data:
-                data['profilePhotos'] = []
-            # Add the new profile photo to the profilePhotos list
-                data['profilePhotos'].append(new_profile_photo)
-    else:
-        print(f"Warning: The file {image_path} does not exist.")
-
-    return
+    print(f"{report['received']} of {report['requested']} persons received from Pure, "
+          f"{report['failed']} failed, {report['missing']} not found")
+    return report
 
 
-def modify_email(data, ref_date, email):
+def index_rows_by_uuid(merged_df) -> dict:
     """
-       :param data: The dictionary containing staff organization associations and other relevant information.
-       :param ref_date: The reference date used to determine valid association periods, as a datetime object.
-       :param email: The email address to add to the staff organization association if none exist.
-       :return: The existing email if found, or the new email if added.
-       """
-
-    if "staffOrganizationAssociations" in data:
-
-        # Check for existing email in valid associations
-        for association in data["staffOrganizationAssociations"]:
-            # Check if 'period' is present
-
-            if "period" in association:
-                assoc_start_date = association["period"].get("startDate")
-                assoc_end_date = association["period"].get("endDate")
-
-                # Convert start and end dates to datetime objects if they exist
-                assoc_start_datetime = datetime.strptime(assoc_start_date, "%Y-%m-%d") if assoc_start_date else None
-                assoc_end_datetime = datetime.strptime(assoc_end_date, "%Y-%m-%d") if assoc_end_date else None
-
-                # Check if the reference date is within the association period
-                if assoc_start_datetime and assoc_start_datetime <= ref_date and (
-                        not assoc_end_datetime or ref_date <= assoc_end_datetime):
-                    # Check if there are existing emails
-
-                    if "emails" in association:
-                        for email in association["emails"]:
-                            return email.get("value")
-
-                        # If no email is found, add one to this valid association
-                    else:
-
-                        new_email_entry = {
-                            # "pureId": "new_pure_id",  # Example placeholder
-                            "value": email,
-                            "type": {
-                                "uri": "/dk/atira/pure/person/personemailtype/email",
-                                "term": {
-                                    "en_GB": "Email"
-                                }
-                            }
-                        }
-                        if "emails" not in association:
-                            association["emails"] = []
-                        association["emails"].append(new_email_entry)
-                        return email
-
-            # If no valid association is found
-        logging.info("No valid staff organization association found with a valid period for the reference date.")
-        return None
-    else:
-        # If no staffOrganizationAssociations exist at all
-        logging.info("No staff organization associations found.")
-        return None
-
-
-def update_profile_information(merged_df, response_json):
+    :param merged_df: A DataFrame containing user profiles with their UUID.
+    :return: A dictionary from UUID to the first row with that UUID, as a dictionary.
     """
-       :param merged_df: A DataFrame containing user profiles with their UUID, Bio, Email, and other profile details.
-       :param response_json: A JSON object containing a list of profile information to be updated.
-       :return: A modified JSON object with updated user profile information.
-       """
-    today_date = datetime.now().date()
-    today_date = datetime.combine(today_date, time())
-    print('STEP 6: making the new jsonfile for all persons with new info')
+    rows_by_uuid = {}
+    for row in merged_df.to_dict('records'):
+        rows_by_uuid.setdefault(row['UUID'], row)
+    return rows_by_uuid
 
 
-    for result in response_json['results']:
-        uuid = result['uuid']
+# The columns of the merged DataFrame that patch_rules.apply_profile_updates() uses.
+PAYLOAD_COLUMNS = patch_rules.payload_columns()
 
-        # Perform a single row lookup for UUID
-        row = merged_df.loc[merged_df['UUID'] == uuid]
-
-        if row.empty:
-            # UUID not found in merged_df, skip
-            continue
 
-        # Extract Bio
-        bio_value = row['DescriptionEN'].values[0] if pd.notna(row['DescriptionEN'].values[0]) else \
-        row['DescriptionNL'].values[0] if pd.notna(row['DescriptionNL'].values[0]) else None
-
-        # Extract and format URL
-        raw_url = row['UrlEN'].values[0] if pd.notna(row['UrlEN'].values[0]) else None
-        url_value = f'<p><a href="{raw_url}">{raw_url}</a></p>' if raw_url else None
-
-        if bio_value or url_value:
-            profile_info = result.get('profileInformation', [])
-
-            # Update or add 'About' field
-            if bio_value:
-                about_found = False
-                for info in profile_info:
-                    if info['type']['term']['en_GB'] == 'About':
-                        info['value']['en_GB'] = bio_value
-                        about_found = True
-                        break
-
-                if not about_found:
-                    new_about = {
-                        'value': {'en_GB': bio_value},
-                        'type': {
-                            'uri': URI_PROFILE,
-                            'term': {'en_GB': 'About'}
-                        }
-                    }
-                    profile_info.append(new_about)
-
-            # Update or add 'Link to Utrecht University staff page' field
-            if url_value:
-                url_found = False
-                for info in profile_info:
-                    if info['type']['term']['en_GB'] == 'Link to Utrecht University staff page':
-                        info['value']['en_GB'] = url_value
-                        url_found = True
-                        break
-
-                if not url_found:
-                    new_url = {
-                        'value': {'en_GB': url_value},
-                        'type': {
-                            'uri': "/dk/atira/pure/person/customfields/profiel_url",
-                            'term': {'en_GB': 'Link to Utrecht University staff page'}
-                        }
-                    }
-                    profile_info.append(new_url)
-
-            # Update the profile information in the result
-            result['profileInformation'] = profile_info
-
-
-        # Extract Email
-        email_value = row['Email'].values[0] if pd.notna(row['Email'].values[0]) else None
-        if email_value:
-            modify_email(result, today_date, email_value)
-        else:
-            print(f"Warning: No email found for UUID: {uuid}")
-
-        # Extract UUSTAFF_PAGE_ID for modifying the profile photo
-        print()
-        name = row['UUSTAFF_PAGE_ID'].values[0] if pd.notna(row['UUSTAFF_PAGE_ID'].values[0]) else None
-        if name:
-            toestemmingfoto = row['ToestemmingProfielfotoInExterneApps'].values[0] if pd.notna(row['ToestemmingProfielfotoInExterneApps'].values[0]) else None
-
-            if toestemmingfoto == True:
-                modify_profile_photo(result, name)
-        # Ensure the 'files' directory exists
-        os.makedirs(files_dir, exist_ok=True)
-        json_path = os.path.join(files_dir, 'input_for_pure2.json')
-        # Save JSON
-        with open(json_path, 'w') as json_file:
-            json.dump(response_json, json_file, indent=4)
-
-    return response_json
-
-
-def convert_ndarrays(obj):
+def payload_hash(row) -> str:
     """
-       :param obj: An object that may contain nested dictionaries, lists, and NumPy arrays.
-       :return: An object with the same structure as input but with all NumPy arrays converted to lists.
-       """
-    if isinstance(obj, dict):
-        return {key: convert_ndarrays(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_ndarrays(element) for element in obj]
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    else:
-        return obj
-
-
-def update_persons(updated_response_json):
+    :param row: A row of the merged DataFrame, as a dictionary.
+    :return: A hash of everything patch_rules.apply_profile_updates() would write to Pure for this person,
+             including the version of the profile photo on disk.
     """
-        :param updated_response_json: JSON data that includes potentially nested dictionary or list structures which may contain NaN values and needs updating.
-        :return: None. Updates `updated_response_json` in place and sends PUT requests to update person records.
-        """
+    values = [patch_rules.row_value(row, column) for column in PAYLOAD_COLUMNS]
+    name = patch_rules.row_value(row, 'UUSTAFF_PAGE_ID')
+    if name and os.path.exists(photos.photo_path(name)):
+        stat = os.stat(photos.photo_path(name))
+        values.append([stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha256(json.dumps(values, default=str).encode('utf-8')).hexdigest()
 
-    def find_nan(data, path=""):
-        """Recursively find and print where NaN values are in the data."""
-        if isinstance(data, dict):
-            for key, value in data.items():
-                new_path = f"{path}.{key}" if path else key
-                find_nan(value, new_path)
-        elif isinstance(data, list):
-            for index, value in enumerate(data):
-                new_path = f"{path}[{index}]"
-                find_nan(value, new_path)
-        elif isinstance(data, float) and math.isnan(data):
-            print(f"NaN value found at: {path}")
 
-    find_nan((updated_response_json))
-    count = 0
-    for data in updated_response_json['results']:
-        data = convert_ndarrays(data)
-        count +=1
-        api_url = API_NEW_BASE + 'persons/' + data['uuid']
-        response = requests.put(api_url, headers=headers, json=data)
-    print(f'updated {count} persons')
+def print_changes_per_field(changes_per_field: dict, changed: int, total: int):
+    for field, changes in changes_per_field.items():
+        print(f'{field}: {changes} changed')
+    print(f'{changed} of {total} persons need an update')
+
 
 def print_summary():
     summary = """
@@ -762,13 +797,45 @@ def get_user_confirmation():
             print("Invalid input. Please enter 'y' to proceed or 'n' to stop:")
 
 
+def harvest_stages(full_sync: bool = False) -> list:
+    """
+    :param full_sync: If True, harvest all active persons again, see persons_active().
+    :return: The stages of the harvest, see stages.run_stages().
+    """
+    return [
+        stages.Stage('persons', lambda: persons_active(full_sync=full_sync),
+                     params={'url': URL_PERSONS_OLD, 'full_sync': full_sync},
+                     ttl=STAGE_TTL_HOURS['persons'] * 3600),
+        stages.Stage('connect', lambda solislist: connect_pure_with_uustaffpages(API_PP, solislist),
+                     inputs=('persons',), params={'url': API_PP},
+                     ttl=STAGE_TTL_HOURS['connect'] * 3600, schema=storage.UUSTAFF_RESULTS_SCHEMA),
+        stages.Stage('photos', dowload_profilepictures,
+                     inputs=('connect',),
+                     ttl=STAGE_TTL_HOURS['photos'] * 3600, schema=storage.UUSTAFF_RESULTS_SCHEMA),
+    ]
+
+
+def parse_arguments():
+    stage_names = [stage.name for stage in harvest_stages()]
+    parser = argparse.ArgumentParser(description='Harvest the UU staff pages and connect them with Pure.')
+    parser.add_argument('--full-sync', action='store_true',
+                        help='ignore the snapshot of active persons and harvest all of them again')
+    parser.add_argument('--force', action='append', default=[], choices=stage_names + ['all'],
+                        help='run this stage even if its cached output is up to date (can be repeated)')
+    parser.add_argument('--skip', action='append', default=[], choices=stage_names,
+                        help='use the cached output of this stage even if it is outdated (can be repeated)')
+    return parser.parse_args()
+
+
 def main():
+    args = parse_arguments()
     print_summary()
     get_user_confirmation()
     # harvest_json_and_write_to_file_uustaffpages(UUSTAFF_HARVEST_FILENAME, API_PP, UUSTAFF_MAX_RECS_TO_HARVEST)
-    solislist = persons_active()
-    parsed_results = connect_pure_with_uustaffpages(API_PP, solislist)
-    merged_df = dowload_profilepictures(parsed_results)
+    force = args.force + (['persons'] if args.full_sync else [])
+    # Only the stages whose input changed or whose cached output expired are run.
+    stages.run_stages(harvest_stages(full_sync=args.full_sync), force=force, skip=args.skip)
+    metrics.write_summary('harvestpp')
     print('Start update_pure.py to update persons in pure')
 
 
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import settings
+
+# Status codes that are worth another try: rate limiting and server hiccups.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# persons/search is a read-only POST and a PUT of a person is idempotent,
+# so all methods used in this project can safely be retried.
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT'])
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to every request that does not set one."""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session() -> requests.Session:
+    """
+    Create a requests session with pooled keep-alive connections, compressed
+    responses, a default timeout and retries with jittered exponential backoff.
+
+    Settings are read from the optional [HTTP] section in config.ini.
+
+    :return: the configured session.
+    """
+    config = settings.get_config()
+    retry = Retry(
+        total=config.getint('HTTP', 'retries', fallback=5),
+        backoff_factor=config.getfloat('HTTP', 'backoff_factor', fallback=0.5),
+        backoff_jitter=config.getfloat('HTTP', 'backoff_jitter', fallback=0.5),
+        backoff_max=config.getfloat('HTTP', 'backoff_max', fallback=60),
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=RETRY_METHODS,
+        respect_retry_after_header=True,
+        # Return the last response instead of raising, so callers can report it.
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=(config.getfloat('HTTP', 'connect_timeout', fallback=10),
+                 config.getfloat('HTTP', 'read_timeout', fallback=60)),
+        # One pool per host (uu.nl, research-portal.uu.nl, ...), each large
+        # enough for all worker threads that use it at the same time.
+        pool_connections=config.getint('HTTP', 'pool_connections', fallback=10),
+        pool_maxsize=config.getint('HTTP', 'pool_maxsize', fallback=32),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    :return: the session shared by all API calls of this process.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request through the shared session and record its latency, size, status and
+    retries in metrics.
+
+    :param method: The http method.
+    :param url: The url.
+    :param kwargs: Passed on to requests.Session.request().
+    :return: The response.
+    """
+    start = time.perf_counter()
+    try:
+        response = get_session().request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        metrics.record_request(method, url, None, time.perf_counter() - start)
+        raise
+    seconds = time.perf_counter() - start
+
+    retries = getattr(response.raw, 'retries', None)
+    body = response.request.body
+    if 'Content-Length' in response.headers:
+        bytes_received = int(response.headers['Content-Length'])
+    elif not kwargs.get('stream'):
+        bytes_received = len(response.content)
+    else:
+        bytes_received = 0
+    metrics.record_request(method, url, response.status_code, seconds,
+                           bytes_sent=len(body) if body else 0,
+                           bytes_received=bytes_received,
+                           retries=len(retries.history) if retries is not None else 0)
+    return response
+
+
+def get(url, **kwargs) -> requests.Response:
+    """Send a GET request through the shared session."""
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs) -> requests.Response:
+    """Send a POST request through the shared session."""
+    return request('POST', url, **kwargs)
+
+
+def put(url, **kwargs) -> requests.Response:
+    """Send a PUT request through the shared session."""
+    return request('PUT', url, **kwargs)
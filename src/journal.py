@@ -0,0 +1,85 @@
+import json
+import os
+from datetime import datetime
+
+import settings
+
+
+JOURNAL_FILENAME = 'update_journal.ndjson'
+
+
+class UpdateJournal:
+    """
+    Append-only journal of the persons that are up to date in Pure, one json line per
+    uuid with the hash of the payload that was written. Every line is flushed to disk
+    before the next person is handled, so after a crash the journal tells exactly which
+    persons do not need to be written again.
+    """
+
+    def __init__(self, path: str = None, resume: bool = False, dry_run: bool = False):
+        """
+        :param path: The journal file, defaults to files/update_journal.ndjson.
+        :param resume: If True, continue the existing journal. Otherwise start a new one.
+        :param dry_run: If True, only read the existing journal; recorded persons are kept in memory.
+        """
+        self.path = path or os.path.join(settings.files_dir, JOURNAL_FILENAME)
+        self.committed = {}
+        if resume:
+            self.committed = load_journal(self.path)
+        self._file = None
+        if dry_run:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a' if resume else 'w')
+        if self._file.tell() > 0:
+            # Do not continue on a line that was cut off by a crash.
+            with open(self.path, 'rb') as journal_file:
+                journal_file.seek(-1, os.SEEK_END)
+                if journal_file.read(1) != b'\n':
+                    self._file.write('\n')
+
+    def is_committed(self, uuid: str, payload_hash: str) -> bool:
+        """
+        :return: True if the person was already written with an identical payload.
+        """
+        return payload_hash is not None and self.committed.get(uuid) == payload_hash
+
+    def record(self, uuid: str, payload_hash: str):
+        """Add a person that is up to date in Pure to the journal."""
+        self.committed[uuid] = payload_hash
+        if self._file is None:
+            return
+        self._file.write(json.dumps({'uuid': uuid, 'hash': payload_hash,
+                                     'time': datetime.now().isoformat(timespec='seconds')}) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_journal(path: str) -> dict:
+    """
+    :param path: The journal file.
+    :return: A dictionary from uuid to the last payload hash written for it. A line that
+             was cut off by a crash is ignored.
+    """
+    committed = {}
+    try:
+        with open(path, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                committed[entry['uuid']] = entry['hash']
+    except FileNotFoundError:
+        pass
+    return committed
@@ -0,0 +1,160 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+
+import settings
+
+
+# Upper bounds in seconds of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+_UUID = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.IGNORECASE)
+_FILE = re.compile(r'/[^/]+\.(jpe?g|png|gif)$', re.IGNORECASE)
+
+_lock = threading.Lock()
+_endpoints = {}
+_stages = {}
+_started = time.time()
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """
+    :param method: The http method.
+    :param url: The url of a request.
+    :return: The url without query string, with uuids and file names replaced by placeholders,
+             so all requests to the same endpoint are counted together.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = _FILE.sub('/{file}', _UUID.sub('{uuid}', parts.path))
+    return f'{method} {parts.netloc}{path}'
+
+
+def record_request(method: str, url: str, status, seconds: float, bytes_sent: int = 0,
+                   bytes_received: int = 0, retries: int = 0):
+    """
+    Count a request to an endpoint. 'status' is the http status code, or None if the request
+    raised an error; both a missing status and a status of 400 or more count as a failure.
+    """
+    name = endpoint_name(method, url)
+    with _lock:
+        endpoint = _endpoints.get(name)
+        if endpoint is None:
+            endpoint = _endpoints[name] = {
+                'requests': 0, 'failures': 0, 'retries': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                'bytes_sent': 0, 'bytes_received': 0, 'statuses': {},
+                'latency_buckets': [0] * len(LATENCY_BUCKETS),
+            }
+        endpoint['requests'] += 1
+        endpoint['retries'] += retries
+        endpoint['seconds'] += seconds
+        endpoint['max_seconds'] = max(endpoint['max_seconds'], seconds)
+        endpoint['bytes_sent'] += bytes_sent
+        endpoint['bytes_received'] += bytes_received
+        status_key = str(status) if status is not None else 'error'
+        endpoint['statuses'][status_key] = endpoint['statuses'].get(status_key, 0) + 1
+        if status is None or status >= 400:
+            endpoint['failures'] += 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                endpoint['latency_buckets'][index] += 1
+                break
+
+
+def record_stage(name: str, seconds: float, failed: bool = False):
+    """Add a run of a pipeline stage and its wall time."""
+    with _lock:
+        stage = _stages.setdefault(name, {'runs': 0, 'failures': 0, 'seconds': 0.0})
+        stage['runs'] += 1
+        stage['seconds'] += seconds
+        if failed:
+            stage['failures'] += 1
+
+
+def timed_stage(name: str):
+    """Decorator that records the wall time of every call of a stage function."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record_stage(name, time.perf_counter() - start, failed)
+        return wrapper
+    return decorator
+
+
+def summary() -> dict:
+    """
+    :return: All metrics recorded so far: per endpoint the request count, failures, retries, status
+             codes, bytes, mean and max latency and a latency histogram, and per stage the wall time.
+    """
+    with _lock:
+        endpoints = json.loads(json.dumps(_endpoints))
+        stages = json.loads(json.dumps(_stages))
+    for endpoint in endpoints.values():
+        endpoint['mean_seconds'] = round(endpoint['seconds'] / endpoint['requests'], 4)
+        endpoint['latency_buckets'] = {('+Inf' if bound == float('inf') else str(bound)): count
+                                       for bound, count in zip(LATENCY_BUCKETS, endpoint['latency_buckets'])}
+    return {
+        'started': datetime.fromtimestamp(_started).isoformat(timespec='seconds'),
+        'seconds': round(time.time() - _started, 3),
+        'endpoints': endpoints,
+        'stages': stages,
+    }
+
+
+def prometheus_text() -> str:
+    """
+    :return: The metrics in the Prometheus text exposition format.
+    """
+    data = summary()
+    lines = []
+    for name, endpoint in data['endpoints'].items():
+        labels = 'endpoint="' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        for counter in ('requests', 'failures', 'retries', 'bytes_sent', 'bytes_received'):
+            lines.append(f'pp_to_pure_http_{counter}_total{{{labels}}} {endpoint[counter]}')
+        cumulative = 0
+        for bound, count in endpoint['latency_buckets'].items():
+            cumulative += count
+            lines.append(f'pp_to_pure_http_request_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'pp_to_pure_http_request_seconds_sum{{{labels}}} {endpoint["seconds"]}')
+        lines.append(f'pp_to_pure_http_request_seconds_count{{{labels}}} {endpoint["requests"]}')
+    for name, stage in data['stages'].items():
+        labels = f'stage="{name}"'
+        lines.append(f'pp_to_pure_stage_seconds_total{{{labels}}} {stage["seconds"]}')
+        lines.append(f'pp_to_pure_stage_runs_total{{{labels}}} {stage["runs"]}')
+        lines.append(f'pp_to_pure_stage_failures_total{{{labels}}} {stage["failures"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_summary(name: str) -> str:
+    """
+    Write the metrics of this run as json and in the Prometheus text format, and print the
+    slowest endpoints.
+
+    :param name: The name of the run, e.g. 'harvestpp', used in the file names.
+    :return: The path of the json file.
+    """
+    data = summary()
+    os.makedirs(settings.files_dir, exist_ok=True)
+    path = os.path.join(settings.files_dir, f'metrics_{name}_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
+    with open(path + '.json', 'w') as metrics_file:
+        json.dump(data, metrics_file, indent=2)
+    with open(path + '.prom', 'w') as metrics_file:
+        metrics_file.write(prometheus_text())
+
+    print('Time spent per endpoint:')
+    for endpoint_key, endpoint in sorted(data['endpoints'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"  {endpoint_key}: {endpoint['requests']} requests, {round(endpoint['seconds'], 1)}s, "
+              f"mean {endpoint['mean_seconds']}s, {endpoint['failures']} failed, {endpoint['retries']} retries")
+    print(f'Metrics written to {path}.json')
+    return path + '.json'
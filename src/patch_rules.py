@@ -0,0 +1,291 @@
+import functools
+import json
+import logging
+import math
+from datetime import datetime
+from typing import Callable, NamedTuple
+
+import photos
+import settings
+
+# In a rule path, selects the staff organization association that is valid on the reference date.
+CURRENT_ASSOCIATION = object()
+
+
+class Rule(NamedTuple):
+    """
+    A field of the Pure person json that is kept in sync with the merged staff pages table.
+    The rule edits one list in the person json: the first item that matches gets the new value,
+    and if no item matches, a new item made from the template is appended.
+    """
+    name: str                   # name of the field in the reports, e.g. 'About'
+    path: tuple                 # keys from the person json to the list the rule edits
+    match: Callable             # item -> True if the rule owns this item of the list
+    source: Callable            # row -> the value to write, or None to leave the field alone
+    template: Callable          # value -> the item appended when no item matches
+    update: Callable = None     # (item, value) -> None; updates a matching item, None keeps it as it is
+    columns: tuple = ()         # the columns of the row that source reads
+
+
+def row_value(row: dict, column: str):
+    """
+    :param row: A row of the merged DataFrame, as a dictionary.
+    :param column: The name of the column.
+    :return: The value in the column, or None if it is missing, NaN or NA.
+    """
+    value = row.get(column)
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if type(value).__name__ in ('NAType', 'NaTType'):
+        return None
+    return value
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(value: str) -> datetime:
+    """
+    :param value: A date as 'YYYY-MM-DD'. Pure uses few distinct dates, so they are parsed only once.
+    :return: The date as a datetime object.
+    """
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def _is_current(association, ref_date) -> bool:
+    """True if the period of the staff organization association includes ref_date."""
+    period = association.get('period')
+    if not period or not period.get('startDate'):
+        return False
+    end_date = period.get('endDate')
+    return parse_date(period['startDate']) <= ref_date and (not end_date or ref_date <= parse_date(end_date))
+
+
+def uri_profile() -> str:
+    """
+    :return: The uri of the About field in Pure. It is read from config.ini when a rule first adds the
+             field, not when this module is imported.
+    """
+    return settings.get_config()['Pure']['uri_profile_en']
+
+
+def _profile_information_rule(name: str, term: str, uri: Callable, source: Callable, columns: tuple) -> Rule:
+    """
+    A rule for a profileInformation field, matched on its en_GB term and overwritten with the new value.
+    uri returns the uri of the field type and is only called when a new item is added.
+    """
+    return Rule(
+        name=name,
+        path=('profileInformation',),
+        match=lambda info: info['type']['term']['en_GB'] == term,
+        source=source,
+        template=lambda value: {'value': {'en_GB': value}, 'type': {'uri': uri(), 'term': {'en_GB': term}}},
+        update=lambda info, value: info['value'].__setitem__('en_GB', value),
+        columns=columns,
+    )
+
+
+def _bio(row):
+    bio = row_value(row, 'DescriptionEN')
+    return bio if bio is not None else row_value(row, 'DescriptionNL')
+
+
+def _staff_page_link(row):
+    url = row_value(row, 'UrlEN')
+    return f'<p><a href="{url}">{url}</a></p>' if url else None
+
+
+def _photo_payload(row):
+    name = row_value(row, 'UUSTAFF_PAGE_ID')
+    if not name or row_value(row, 'ToestemmingProfielfotoInExterneApps') != True:
+        return None
+    payload = photos.get_photo_payload(name)
+    if payload is None:
+        print(f"Warning: No usable photo {photos.photo_path(name)} exists.")
+    return payload
+
+
+def _email_entry(email):
+    return {
+        "value": email,
+        "type": {
+            "uri": "/dk/atira/pure/person/personemailtype/email",
+            "term": {
+                "en_GB": "Email"
+            }
+        }
+    }
+
+
+def _profile_photo(payload):
+    return {
+        "fileName": "profilepicture.jpg",
+        "mimeType": "image/jpeg",
+        "size": payload['size'],  # Size in bytes (<= photos.PHOTO_MAX_BYTES)
+        "fileData": payload['fileData'],
+        "copyrightConfirmation": True,
+        "type": {
+            "uri": "/dk/atira/pure/person/personfiles/portrait",
+            "term": {
+                "en_GB": "Portrait"
+            }
+        },
+        "caption": {
+            "en": "Profile photo"
+        },
+        "altText": {
+            "en": "A profile picture"
+        },
+        "copyrightStatement": {
+            "en": "© 2024 by User"
+        }
+    }
+
+
+# The fields written to Pure. To sync another field harvested from the staff pages, e.g. FocusAreas,
+# add a rule here; rules on the same list are applied in the same pass over it.
+PROFILE_RULES = (
+    _profile_information_rule('About', 'About', uri_profile, _bio, ('DescriptionEN', 'DescriptionNL')),
+    _profile_information_rule('Staff page link', 'Link to Utrecht University staff page',
+                              lambda: '/dk/atira/pure/person/customfields/profiel_url', _staff_page_link, ('UrlEN',)),
+    # An existing email is kept, a new one is only added to a current association without email.
+    Rule(name='Email', path=('staffOrganizationAssociations', CURRENT_ASSOCIATION, 'emails'),
+         match=lambda email: True, source=lambda row: row_value(row, 'Email') or None,
+         template=_email_entry, columns=('Email',)),
+    # An existing photo is not replaced.
+    Rule(name='Profile photo', path=('profilePhotos',), match=lambda photo: True, source=_photo_payload,
+         template=_profile_photo, columns=('UUSTAFF_PAGE_ID', 'ToestemmingProfielfotoInExterneApps')),
+)
+
+
+def compile_rules(rules) -> tuple:
+    """
+    :param rules: An iterable of Rule.
+    :return: The rules grouped by the list they edit, as (path, rules) pairs, so apply() walks
+             every list only once, however many rules edit it.
+    """
+    by_path = {}
+    for rule in rules:
+        by_path.setdefault(rule.path, []).append(rule)
+    return tuple((path, tuple(path_rules)) for path, path_rules in by_path.items())
+
+
+COMPILED_PROFILE_RULES = compile_rules(PROFILE_RULES)
+
+
+def _target_container(person, path, ref_date):
+    """
+    :return: The dictionary in the person json that holds the list at path, or None if the path
+             does not exist, e.g. when no association is current.
+    """
+    container = person
+    for key in path[:-1]:
+        if key is CURRENT_ASSOCIATION:
+            container = next((association for association in container
+                              if _is_current(association, ref_date)), None)
+            if container is None:
+                logging.info("No valid staff organization association found with a valid period for the reference date.")
+                return None
+        else:
+            container = container.get(key)
+            if container is None:
+                logging.info(f"No {key} found.")
+                return None
+    return container
+
+
+def apply(person, row, ref_date, compiled_rules=COMPILED_PROFILE_RULES) -> list:
+    """
+    :param person: The Pure json of a single person, modified in place.
+    :param row: The row of the merged DataFrame for this person, as a dictionary.
+    :param ref_date: The reference date used to find the current staff organization association.
+    :param compiled_rules: The rules to apply, see compile_rules().
+    :return: The names of the rules that had no value in the row, so the person was left alone.
+             The value of a rule is only looked up when it is written: a rule without update that
+             matches an item, e.g. an existing photo, never reads its source.
+    """
+    missing = []
+    for path, rules in compiled_rules:
+        container = _target_container(person, path, ref_date)
+        if container is None:
+            continue
+        pending = list(rules)
+        for item in container.get(path[-1]) or []:
+            for index, rule in enumerate(pending):
+                if rule.match(item):
+                    del pending[index]
+                    if rule.update is not None:
+                        value = rule.source(row)
+                        if value is None:
+                            missing.append(rule.name)
+                        else:
+                            rule.update(item, value)
+                    break
+            if not pending:
+                break
+        for rule in pending:
+            value = rule.source(row)
+            if value is None:
+                missing.append(rule.name)
+                continue
+            if container.get(path[-1]) is None:
+                container[path[-1]] = []
+            container[path[-1]].append(rule.template(value))
+    return missing
+
+
+def extract(person, rule: Rule) -> list:
+    """
+    :param person: The Pure json of a single person.
+    :param rule: A Rule.
+    :return: The items the rule owns in the person json, for every association rather than only the current one.
+    """
+    containers = [person]
+    for key in rule.path[:-1]:
+        if key is CURRENT_ASSOCIATION:
+            containers = [element for container in containers for element in container]
+        else:
+            containers = [container[key] for container in containers if container.get(key) is not None]
+    return [[item for item in container.get(rule.path[-1]) or [] if rule.match(item)] for container in containers]
+
+
+def payload_columns(rules=PROFILE_RULES) -> list:
+    """
+    :return: The columns of the merged DataFrame that the rules read, in order and without duplicates.
+    """
+    return list(dict.fromkeys(column for rule in rules for column in rule.columns))
+
+
+def apply_profile_updates(result, row, ref_date):
+    """
+    :param result: The Pure json of a single person, modified in place.
+    :param row: The row of the merged DataFrame for this person, as a dictionary.
+    :param ref_date: The reference date used to find the current staff organization association.
+    :return: None. Updates the About text, the link to the staff page, the email and the profile photo,
+             see PROFILE_RULES.
+    """
+    apply(result, row, ref_date)
+    # The email rule only reads the row for a current association without email, so check it here.
+    if row_value(row, 'Email') is None:
+        print(f"Warning: No email found for UUID: {result['uuid']}")
+
+
+# The fields changed by apply_profile_updates(), with a function that extracts each
+# of them from the Pure json of a person.
+PERSON_DIFF_FIELDS = {rule.name: functools.partial(extract, rule=rule) for rule in PROFILE_RULES}
+
+
+def person_fields(person) -> dict:
+    """
+    :param person: The Pure json of a single person.
+    :return: The serialized value of each field in PERSON_DIFF_FIELDS.
+    """
+    return {field: json.dumps(extractor(person), sort_keys=True) for field, extractor in PERSON_DIFF_FIELDS.items()}
+
+
+def changed_fields(original, person) -> list:
+    """
+    :param original: The fields of the person before it was updated, see person_fields(), or None if unknown.
+    :param person: The Pure json of the person after it was updated.
+    :return: The names of the fields in PERSON_DIFF_FIELDS that changed.
+    """
+    return [field for field, extractor in PERSON_DIFF_FIELDS.items()
+            if original is None or original[field] != json.dumps(extractor(person), sort_keys=True)]
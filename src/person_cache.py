@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import time
+
+import serializer
+import settings
+
+
+CACHE_FILENAME = 'pure_person_cache.sqlite'
+PERSON_CACHE_MAX_DOCUMENT_AGE_DAYS = 7   # a cached document is fetched again after this many days anyway
+SQLITE_MAX_VARIABLES = 500               # uuids per SELECT or DELETE
+
+# Set to False to run without the cache, e.g. by shards.run_shard() when the cache would be on a
+# directory shared by several hosts. Nothing is then read from or stored in the database.
+enabled = True
+
+
+def cache_path() -> str:
+    """
+    :return: The database file: 'person_cache_path' in the [Pure] section of config.ini, or
+             files/pure_person_cache.sqlite. SQLite in WAL mode needs a disk that is local to the
+             host, so it must not be on a network filesystem shared by several hosts.
+    """
+    path = settings.get_config().get('Pure', 'person_cache_path', fallback='')
+    return path or os.path.join(settings.files_dir, CACHE_FILENAME)
+
+
+class PersonCache:
+    """
+    The Pure json of persons, as returned by the persons/search endpoint, keyed by uuid and the
+    modification date the old Pure API lists for the person. A cached document is only used
+    while the person was not modified in Pure since it was fetched, which the snapshot of
+    active persons tells without a request per person, see harvestpp.persons_active().
+
+    A connection belongs to the thread that created the cache; other threads and processes
+    on the same host can use their own PersonCache on the same file. While the module is not
+    enabled, the cache is empty and stores nothing.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: The database file, defaults to cache_path().
+        """
+        self.path = path or cache_path()
+        self._connection = None
+        if not enabled:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30)
+        # Let readers continue while another thread or shard on this host writes.
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS persons '
+                                 '(uuid TEXT PRIMARY KEY, modified TEXT, version TEXT, cached_at REAL, document BLOB)')
+
+    def valid_uuids(self, modified_by_uuid: dict) -> set:
+        """
+        :param modified_by_uuid: The current Pure modification date of every person, by uuid.
+        :return: The uuids whose cached document has the same modification date and is not too old.
+                 Only the small columns are read, not the documents.
+        """
+        if not modified_by_uuid or self._connection is None:
+            return set()
+        oldest = time.time() - PERSON_CACHE_MAX_DOCUMENT_AGE_DAYS * 24 * 3600
+        rows = self._connection.execute('SELECT uuid, modified FROM persons WHERE cached_at >= ?', (oldest,))
+        return {uuid for uuid, modified in rows if modified is not None and modified_by_uuid.get(uuid) == modified}
+
+    def get(self, uuids: list) -> list:
+        """
+        :param uuids: A list of uuids, e.g. from valid_uuids().
+        :return: The cached Pure json of the persons, in the order of uuids, without the ones that are not cached.
+        """
+        if self._connection is None:
+            return []
+        documents = {}
+        for i in range(0, len(uuids), SQLITE_MAX_VARIABLES):
+            chunk = uuids[i:i + SQLITE_MAX_VARIABLES]
+            rows = self._connection.execute(
+                f'SELECT uuid, document FROM persons WHERE uuid IN ({",".join("?" * len(chunk))})', chunk)
+            documents.update((uuid, serializer.loads(document)) for uuid, document in rows)
+        return [documents[uuid] for uuid in uuids if uuid in documents]
+
+    def store(self, persons: list, modified_by_uuid: dict):
+        """
+        :param persons: The Pure json of persons, just fetched and not yet modified.
+        :param modified_by_uuid: The Pure modification date of every person, by uuid. A person
+                                 without one is stored, but never used, until it is fetched again.
+        """
+        if self._connection is None:
+            return
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO persons VALUES (?, ?, ?, ?, ?)',
+                ((person['uuid'], modified_by_uuid.get(person['uuid']), person.get('version'), now,
+                  serializer.dumps(person, 'null')) for person in persons))
+
+    def invalidate(self, uuids: list):
+        """Forget the persons, e.g. after they were written to Pure."""
+        if self._connection is None:
+            return
+        with self._connection:
+            for i in range(0, len(uuids), SQLITE_MAX_VARIABLES):
+                chunk = uuids[i:i + SQLITE_MAX_VARIABLES]
+                self._connection.execute(f'DELETE FROM persons WHERE uuid IN ({",".join("?" * len(chunk))})', chunk)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
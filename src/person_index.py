@@ -0,0 +1,73 @@
+import json
+import os
+import sqlite3
+
+import settings
+
+
+INDEX_FILENAME = 'uustaff_index.sqlite'
+# What str() made of a missing value in indexes built before, see storage.coerce().
+MISSING_TEXT = ('None', 'nan', 'NaN')
+
+
+def index_path() -> str:
+    return os.path.join(settings.files_dir, INDEX_FILENAME)
+
+
+def build_index(merged_df, path: str = None):
+    """
+    Store the rows of the uustaff_results table in an SQLite database keyed on SOLIS_ID and
+    UUID, so a single person can be found without loading the table. The database is built
+    next to the old one and then swapped in.
+
+    :param merged_df: The DataFrame of the uustaff_results table.
+    :param path: The database file, defaults to files/uustaff_index.sqlite.
+    """
+    path = path or index_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path + '.tmp'):
+        os.remove(path + '.tmp')
+    # Missing values (pd.NA, NaN) become None, which is null in json.
+    rows = merged_df.astype(object).where(merged_df.notna(), None).to_dict('records')
+    with sqlite3.connect(path + '.tmp') as connection:
+        connection.execute('CREATE TABLE persons (solis_id TEXT, uuid TEXT, row TEXT)')
+        connection.executemany('INSERT INTO persons VALUES (?, ?, ?)',
+                               ((row['SOLIS_ID'], row['UUID'], json.dumps(row)) for row in rows))
+        connection.execute('CREATE INDEX persons_solis_id ON persons (solis_id)')
+        connection.execute('CREATE INDEX persons_uuid ON persons (uuid)')
+    connection.close()
+    os.replace(path + '.tmp', path)
+
+
+def _lookup(column: str, value: str, path: str = None):
+    path = path or index_path()
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    with sqlite3.connect(f'file:{path}?mode=ro', uri=True) as connection:
+        # The first row wins, like the first match in the DataFrame.
+        found = connection.execute(f'SELECT row FROM persons WHERE {column} = ? ORDER BY rowid LIMIT 1',
+                                   (value,)).fetchone()
+    connection.close()
+    if not found:
+        return None
+    return {key: None if value in MISSING_TEXT else value for key, value in json.loads(found[0]).items()}
+
+
+def lookup_solis_id(solis_id: str, path: str = None):
+    """
+    :param solis_id: The SolisID of the person, in any case.
+    :param path: The database file, defaults to files/uustaff_index.sqlite.
+    :return: The row of the person in the uustaff_results table as a dictionary, or None if not found.
+    :raises FileNotFoundError: if there is no index yet.
+    """
+    return _lookup('solis_id', solis_id.strip().upper(), path)
+
+
+def lookup_uuid(uuid: str, path: str = None):
+    """
+    :param uuid: The Pure uuid of the person.
+    :param path: The database file, defaults to files/uustaff_index.sqlite.
+    :return: The row of the person in the uustaff_results table as a dictionary, or None if not found.
+    :raises FileNotFoundError: if there is no index yet.
+    """
+    return _lookup('uuid', uuid, path)
@@ -0,0 +1,240 @@
+import base64
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+import http_client
+import metrics
+import settings
+
+PHOTOS_MAX_WORKERS = 8                 # photos downloaded at the same time
+PHOTOS_MANIFEST_FILENAME = 'manifest.json'
+PHOTO_MAX_DIMENSION = 1200             # max width and height in pixels of a photo sent to Pure
+PHOTO_MAX_BYTES = 1024 * 1024          # Pure accepts photos up to 1MB
+PHOTO_JPEG_QUALITIES = (85, 75, 65, 55, 45)
+CHUNK_SIZE = 64 * 1024
+
+
+def photo_path(page_id: str) -> str:
+    """
+    :param page_id: The UUSTAFF_PAGE_ID of the person.
+    :return: The path of the profile picture of the person.
+    """
+    return os.path.join(settings.photos_dir, f"{page_id}.jpg")
+
+
+def payload_path(page_id: str) -> str:
+    """
+    :param page_id: The UUSTAFF_PAGE_ID of the person.
+    :return: The path of the cached, base64 encoded payload of the profile picture of the person.
+    """
+    return os.path.join(settings.photos_dir, f"{page_id}.payload.json")
+
+
+def load_manifest() -> dict:
+    """
+    :return: A dictionary from UUSTAFF_PAGE_ID to the 'url', 'etag' and 'last_modified'
+             of the last downloaded version of each photo.
+    """
+    try:
+        with open(os.path.join(settings.photos_dir, PHOTOS_MANIFEST_FILENAME), 'r') as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest: dict):
+    """Write the manifest to a temporary file first, so an interrupted run keeps the previous one."""
+    manifest_path = os.path.join(settings.photos_dir, PHOTOS_MANIFEST_FILENAME)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def download_photo(page_id: str, url: str, known: dict = None):
+    """
+    Download a single photo, unless it did not change since it was last downloaded.
+
+    :param page_id: The UUSTAFF_PAGE_ID of the person, used as file name.
+    :param url: The url of the photo.
+    :param known: The manifest entry of the previous download, if any.
+    :return: A tuple of the outcome ('downloaded', 'unchanged' or 'failed') and the new manifest entry.
+    """
+    filename = photo_path(page_id)
+    request_headers = {"User-Agent": "Mozilla/5.0"}
+    # Only ask for changes if we still have the photo the validators belong to.
+    if known and known.get('url') == url and os.path.exists(filename):
+        if known.get('etag'):
+            request_headers['If-None-Match'] = known['etag']
+        if known.get('last_modified'):
+            request_headers['If-Modified-Since'] = known['last_modified']
+
+    try:
+        with http_client.get(url, headers=request_headers, stream=True) as response:
+            if response.status_code == requests.codes.not_modified:
+                return 'unchanged', known
+            if response.status_code != requests.codes.ok:
+                print(f"Failed to download image for {page_id}. Status code: {response.status_code}")
+                return 'failed', known
+
+            # Stream the body to a temporary file and rename it, so a photo is
+            # never left half written.
+            tmp_filename = filename + '.part'
+            with open(tmp_filename, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    file.write(chunk)
+            os.replace(tmp_filename, filename)
+            return 'downloaded', {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to download image for {page_id}: {e}")
+        return 'failed', known
+
+
+@metrics.timed_stage('download_photos')
+def download_photos(photos: list, max_workers: int = PHOTOS_MAX_WORKERS) -> list:
+    """
+    Download photos concurrently, using conditional requests to skip the ones that did not change.
+
+    :param photos: A list of (UUSTAFF_PAGE_ID, url) tuples.
+    :param max_workers: The maximum number of photos downloaded at the same time.
+    :return: The UUSTAFF_PAGE_IDs of the photos that were (re)downloaded.
+    """
+    os.makedirs(settings.photos_dir, exist_ok=True)
+    manifest = load_manifest()
+    downloaded = []
+    outcomes = {'downloaded': 0, 'unchanged': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda photo: download_photo(photo[0], photo[1], manifest.get(photo[0])),
+                               photos)
+        for count, ((page_id, url), (outcome, entry)) in enumerate(zip(photos, results), start=1):
+            outcomes[outcome] += 1
+            if entry:
+                manifest[page_id] = entry
+            if outcome == 'downloaded':
+                downloaded.append(page_id)
+            if count % 50 == 0:
+                print(count, '(' + datetime.now().strftime('%H:%M') + ')  ', end='', flush=True)
+            if count % 500 == 0:
+                print('\n', end='', flush=True)
+    save_manifest(manifest)
+    print(f"\n{outcomes['downloaded']} photos downloaded, {outcomes['unchanged']} unchanged, "
+          f"{outcomes['failed']} failed")
+    return downloaded
+
+
+def normalize_photo(image_data: bytes, max_dimension: int = PHOTO_MAX_DIMENSION,
+                    max_bytes: int = PHOTO_MAX_BYTES):
+    """
+    :param image_data: The content of a jpeg file.
+    :param max_dimension: The maximum width and height of the photo.
+    :param max_bytes: The maximum size of the photo in bytes.
+    :return: The photo, downscaled and recompressed if it is too large, or None if it
+             cannot be made small enough or is not an image at all, e.g. an html error page.
+    """
+    # Pillow is only needed when a payload is rebuilt, so it is not loaded when the payloads are cached.
+    try:
+        from PIL import Image
+    except ImportError:  # Pillow is optional, without it oversized photos are skipped.
+        return image_data if len(image_data) <= max_bytes else None
+
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        if len(image_data) <= max_bytes and max(image.size) <= max_dimension:
+            return image_data
+
+        image = image.convert('RGB')
+        while True:
+            image.thumbnail((max_dimension, max_dimension))
+            for quality in PHOTO_JPEG_QUALITIES:
+                buffer = io.BytesIO()
+                image.save(buffer, format='JPEG', quality=quality, optimize=True)
+                if buffer.tell() <= max_bytes:
+                    return buffer.getvalue()
+            if max_dimension < 100:
+                return None
+            max_dimension = int(max_dimension * 0.75)
+    except (OSError, Image.DecompressionBombError) as e:
+        # Also raised for truncated files, which Pillow only notices when the image is loaded.
+        print(f"Warning: Cannot read the photo: {e}")
+        return None
+
+
+def _payload_is_current(page_id: str, payload: dict) -> bool:
+    """Check whether a cached payload was made from the photo that is on disk now."""
+    stat = os.stat(photo_path(page_id))
+    return payload.get('source_size') == stat.st_size and payload.get('source_mtime_ns') == stat.st_mtime_ns
+
+
+def prepare_photo(page_id: str):
+    """
+    Normalize a downloaded photo and cache its base64 payload next to the image, unless
+    the cache is already up to date. Runs in a worker process of prepare_photos().
+
+    :param page_id: The UUSTAFF_PAGE_ID of the person.
+    :return: The payload: the base64 'fileData', its true 'size' in bytes and the 'sha256' of the
+             photo, or None if there is no usable photo.
+    """
+    image_path = photo_path(page_id)
+    if not os.path.exists(image_path):
+        return None
+    try:
+        with open(payload_path(page_id), 'r') as payload_file:
+            payload = json.load(payload_file)
+        if _payload_is_current(page_id, payload):
+            return payload
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    stat = os.stat(image_path)
+    with open(image_path, 'rb') as image_file:
+        image_data = normalize_photo(image_file.read())
+    if image_data is None:
+        print(f"Warning: The photo {image_path} is not a usable image or larger than {PHOTO_MAX_BYTES} bytes "
+              f"and is skipped.")
+        return None
+
+    payload = {
+        'fileData': base64.b64encode(image_data).decode('utf-8'),
+        'size': len(image_data),
+        'sha256': hashlib.sha256(image_data).hexdigest(),
+        'source_size': stat.st_size,
+        'source_mtime_ns': stat.st_mtime_ns,
+    }
+    with open(payload_path(page_id) + '.tmp', 'w') as payload_file:
+        json.dump(payload, payload_file)
+    os.replace(payload_path(page_id) + '.tmp', payload_path(page_id))
+    return payload
+
+
+@metrics.timed_stage('prepare_photos')
+def prepare_photos(page_ids: list, max_workers: int = None):
+    """
+    Normalize photos and build their payload cache in a pool of processes, so encoding
+    does not have to happen while the persons are being updated.
+
+    :param page_ids: The UUSTAFF_PAGE_IDs of the persons.
+    :param max_workers: The number of processes, defaults to the number of cpus.
+    """
+    print(f'Preparing {len(page_ids)} profile pictures for Pure')
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Only the outcome is needed here, the payloads themselves stay on disk.
+        prepared = sum(1 for payload in executor.map(prepare_photo, page_ids, chunksize=16) if payload)
+    print(f'{prepared} profile pictures ready')
+
+
+def get_photo_payload(page_id: str):
+    """
+    :param page_id: The UUSTAFF_PAGE_ID of the person.
+    :return: The cached payload of the photo of the person, see prepare_photo(). It is
+             built first if it is missing or outdated. None if there is no usable photo.
+    """
+    return prepare_photo(page_id)
@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+from datetime import datetime, time
+
+import harvestpp as pp
+import metrics
+import patch_rules
+import pure_writer
+import serializer
+import settings
+
+PIPELINE_QUEUE_SIZE = 4         # fetched chunks waiting to be updated
+
+_DONE = object()
+
+
+def _refresh_changed(persons, rows_by_uuid, ref_date):
+    """
+    A cached person may have been edited in Pure after the snapshot of active persons vouched for
+    the cache, and a PUT writes the whole json back. So the cache only tells which persons change:
+    those are fetched from Pure again, right before they are updated and written.
+
+    :param persons: The cached Pure json of persons, modified in place.
+    :param rows_by_uuid: The rows of the merged DataFrame, by uuid.
+    :param ref_date: The reference date used to find the current staff organization association.
+    :return: A tuple of the persons, with the ones that change replaced by their current Pure json,
+             and the uuids that could not be fetched again.
+    """
+    changed_uuids = []
+    for person in persons:
+        row = rows_by_uuid.get(person['uuid'])
+        if row is None:
+            continue
+        original = patch_rules.person_fields(person)
+        patch_rules.apply(person, row, ref_date)
+        if patch_rules.changed_fields(original, person):
+            changed_uuids.append(person['uuid'])
+    if not changed_uuids:
+        return persons, []
+    current, failed = pp.search_persons_resilient(changed_uuids)
+    changed_uuids = set(changed_uuids)
+    return [person for person in persons if person['uuid'] not in changed_uuids] + current, failed
+
+
+def _fetch_chunks(uuids, chunk_size, fetched):
+    """
+    Fetch the Pure json of the persons chunk by chunk and put each chunk on the queue.
+    Blocks while the queue is full, so fetching never runs far ahead of writing.
+    """
+    try:
+        for chunk in pp.iter_person_chunks(uuids, chunk_size):
+            fetched.put(chunk)
+    except BaseException as e:
+        fetched.put(e)
+    finally:
+        fetched.put(_DONE)
+
+
+@metrics.timed_stage('stream_update')
+def stream_update(merged_df, on_success=None, on_unchanged=None,
+                  chunk_size: int = None, queue_size: int = PIPELINE_QUEUE_SIZE,
+                  json_path: str = None, outcomes_path: str = None, max_requests_per_second: float = None,
+                  dry_run: bool = False) -> list:
+    """
+    Update all persons in merged_df in Pure, one chunk at a time. A background thread fetches
+    chunks from Pure while earlier chunks are updated and written, and bounded queues between
+    the stages keep only a few chunks in memory, however many persons there are.
+
+    :param merged_df: The DataFrame of the uustaff_results table.
+    :param on_success: Optional function called with the uuid of every person that was written.
+    :param on_unchanged: Optional function called with the uuid of every person that did not need an update.
+    :param chunk_size: The number of persons fetched from Pure per request, see harvestpp.iter_person_chunks().
+    :param queue_size: The number of fetched chunks that may wait to be updated.
+    :param json_path: The file the updated persons are written to, one json per line.
+                      Defaults to files/input_for_pure2.ndjson.
+    :param outcomes_path: The csv file with the outcome per uuid, see pure_writer.write_persons().
+    :param max_requests_per_second: The ceiling for the PUT rate, see pure_writer.write_persons().
+    :param dry_run: If True, fetch, update and compare the persons, but do not write them to Pure.
+                    Cached persons are then compared as they are, without fetching them again.
+    :return: A list with the outcome of every PUT, see pure_writer.put_person().
+    """
+    print('STEP 5-7: fetching, updating and writing the persons chunk by chunk')
+    today_date = datetime.combine(datetime.now().date(), time())
+    rows_by_uuid = pp.index_rows_by_uuid(merged_df)
+    uuids = [uuid for uuid in rows_by_uuid if isinstance(uuid, str) and uuid]
+    changes_per_field = dict.fromkeys(patch_rules.PERSON_DIFF_FIELDS, 0)
+    counts = {'total': 0, 'changed': 0}
+    received_uuids = []
+    failed_uuids = []
+
+    fetched = queue.Queue(maxsize=queue_size)
+    fetcher = threading.Thread(target=_fetch_chunks, args=(uuids, chunk_size, fetched), daemon=True)
+    fetcher.start()
+
+    if json_path is None:
+        json_path = os.path.join(settings.files_dir, pp.INPUT_FOR_PURE_FILENAME)
+    os.makedirs(os.path.dirname(json_path), exist_ok=True)
+
+    def changed_persons(json_file):
+        """Update each fetched person and yield only the ones that changed."""
+        while True:
+            chunk = fetched.get()
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            requested, items, failed, cached = chunk
+            failed_uuids.extend(failed)
+            if cached and not dry_run:
+                items, failed = _refresh_changed(items, rows_by_uuid, today_date)
+                failed_uuids.extend(failed)
+            for result in items:
+                received_uuids.append(result['uuid'])
+                original = patch_rules.person_fields(result)
+                row = rows_by_uuid.get(result['uuid'])
+                if row is not None:
+                    patch_rules.apply_profile_updates(result, row, today_date)
+                try:
+                    json_file.write(serializer.dumps(result) + b'\n')
+                except serializer.SerializationError as e:
+                    # E.g. NaN with the 'reject' policy. A changed person is still passed on, and
+                    # pure_writer.put_person() records it as failed without writing it.
+                    print(f"Not saving {result['uuid']}: {e}")
+
+                counts['total'] += 1
+                changes = patch_rules.changed_fields(original, result)
+                for field in changes:
+                    changes_per_field[field] += 1
+                if changes:
+                    counts['changed'] += 1
+                    yield result
+                elif on_unchanged is not None:
+                    on_unchanged(result['uuid'])
+
+    with open(json_path, 'wb') as json_file:
+        if dry_run:
+            outcomes = []
+            for person in changed_persons(json_file):
+                pass
+            print(f"Dry run: {counts['changed']} persons would be written, see {json_path}")
+        else:
+            outcomes = pure_writer.write_persons(changed_persons(json_file), on_success=on_success,
+                                                 outcomes_path=outcomes_path,
+                                                 max_requests_per_second=max_requests_per_second)
+    fetcher.join()
+
+    pp.print_changes_per_field(changes_per_field, counts['changed'], counts['total'])
+    pp.completeness_report(len(uuids), received_uuids, failed_uuids)
+    return outcomes
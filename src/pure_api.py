@@ -0,0 +1,28 @@
+import http_client
+import settings
+
+
+def search_persons(uuids):
+    """
+    :param uuids: A list of at most harvestpp.PURE_SEARCH_MAX_CHUNK_SIZE uuids.
+    :return: The Pure json of the persons, from the persons/search endpoint of the CRUD API.
+    :raises requests.exceptions.RequestException: if the request fails.
+    """
+    config = settings.get_config()
+    headers = {
+        "accept": "application/json",
+        "api-key": config['Pure']['pure_api_key_crud'],
+        "content-type": "application/json"
+    }
+    # Prepare the payload
+    payload = {
+        "uuids": uuids,
+        "size": max(len(uuids), 100),
+        "offset": 0
+    }
+
+    # Make the POST request
+    response = http_client.post(config['Pure']['api_url_persons_search'], headers=headers, json=payload)
+    response.raise_for_status()  # Raise an error if the request fails
+    # Extract the items from the JSON response
+    return response.json().get("items", [])
@@ -0,0 +1,183 @@
+import csv
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+import http_client
+import metrics
+import person_cache
+import serializer
+import settings
+
+PURE_WRITE_MAX_WORKERS = 4               # PUTs in flight at the same time
+PURE_WRITE_MAX_REQUESTS_PER_SECOND = 5   # ceiling for the PUT rate
+PURE_WRITE_MIN_REQUESTS_PER_SECOND = 0.2
+THROTTLE_STATUS_CODES = (429, 500, 502, 503, 504)
+OUTCOME_FIELDS = ['uuid', 'status', 'latency', 'error']
+
+
+class RateLimiter:
+    """
+    Spaces requests from several threads to at most max_rate per second. The rate is
+    halved when Pure pushes back and grows again slowly while requests succeed.
+    """
+
+    def __init__(self, max_rate: float, min_rate: float = PURE_WRITE_MIN_REQUESTS_PER_SECOND):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until the next request may be sent."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + 1 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def slow_down(self, retry_after: float = None):
+        """Halve the rate, and pause all threads for retry_after seconds if Pure asked for it."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self._next_slot = max(self._next_slot, time.monotonic() + retry_after)
+
+    def speed_up(self):
+        """Raise the rate a little, up to the ceiling."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def _retry_after(response) -> float:
+    """
+    :param response: A response from Pure.
+    :return: The number of seconds in its Retry-After header, or None.
+    """
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _was_throttled(response) -> bool:
+    """
+    :param response: A response from Pure.
+    :return: True if Pure returned 429 or 5xx, either finally or for one of the retries of http_client.
+    """
+    if response.status_code in THROTTLE_STATUS_CODES:
+        return True
+    retries = getattr(response.raw, 'retries', None)
+    history = retries.history if retries is not None else ()
+    return any(attempt.status in THROTTLE_STATUS_CODES for attempt in history)
+
+
+def put_person(data, rate_limiter: RateLimiter) -> dict:
+    """
+    :param data: The Pure json of a single person. It is serialized by serializer.dumps(), so it may
+                 still hold numpy values; a person with NaN is not sent if the nan_policy is 'reject'.
+    :param rate_limiter: The rate limiter shared by all writer threads.
+    :return: The outcome of the PUT: 'uuid', 'status' (the http status code or 'error'),
+             'latency' in seconds and the 'error' body if it failed.
+    """
+    config = settings.get_config()
+    api_url = config['Pure']['api_url_base'] + 'persons/' + data['uuid']
+    headers = {
+        "accept": "application/json",
+        "api-key": config['Pure']['pure_api_key_crud'],
+        "content-type": "application/json"
+    }
+    try:
+        body = serializer.dumps(data)
+    except serializer.SerializationError as e:
+        print(f"Not updating {data['uuid']}: {e}")
+        return {'uuid': data['uuid'], 'status': 'error', 'latency': 0, 'error': str(e)}
+    rate_limiter.acquire()
+    start = time.monotonic()
+    try:
+        response = http_client.put(api_url, headers=headers, data=body)
+    except requests.exceptions.RequestException as e:
+        rate_limiter.slow_down()
+        return {'uuid': data['uuid'], 'status': 'error', 'latency': round(time.monotonic() - start, 3),
+                'error': str(e)}
+    latency = round(time.monotonic() - start, 3)
+
+    if _was_throttled(response):
+        rate_limiter.slow_down(_retry_after(response))
+    else:
+        rate_limiter.speed_up()
+    succeeded = 200 <= response.status_code < 300
+    return {'uuid': data['uuid'], 'status': response.status_code, 'latency': latency,
+            'error': '' if succeeded else response.text[:1000]}
+
+
+@metrics.timed_stage('write_persons')
+def write_persons(persons, max_workers: int = None, max_requests_per_second: float = None,
+                  outcomes_path: str = None, on_success=None) -> list:
+    """
+    PUT persons to Pure with a bounded number of concurrent requests and a rate ceiling.
+
+    :param persons: An iterable of Pure person jsons. It is consumed lazily, so it can be a generator.
+    :param max_workers: The maximum number of PUTs in flight. Defaults to 'write_max_workers'
+                        in the [Pure] section of config.ini, or PURE_WRITE_MAX_WORKERS.
+    :param max_requests_per_second: The ceiling for the request rate. Defaults to
+                        'write_max_requests_per_second' in config.ini, or PURE_WRITE_MAX_REQUESTS_PER_SECOND.
+    :param outcomes_path: The csv file the outcome per uuid is written to, as soon as it is known.
+                          Defaults to files/update_outcomes.csv.
+    :param on_success: Optional function called with the uuid of every person that was written,
+                       in the calling thread, e.g. to record it in a journal.
+    :return: A list with the outcome of every PUT, see put_person().
+    """
+    config = settings.get_config()
+    if max_workers is None:
+        max_workers = config.getint('Pure', 'write_max_workers', fallback=PURE_WRITE_MAX_WORKERS)
+    if max_requests_per_second is None:
+        max_requests_per_second = config.getfloat('Pure', 'write_max_requests_per_second',
+                                                  fallback=PURE_WRITE_MAX_REQUESTS_PER_SECOND)
+    if outcomes_path is None:
+        outcomes_path = os.path.join(settings.files_dir, 'update_outcomes.csv')
+    os.makedirs(os.path.dirname(outcomes_path), exist_ok=True)
+
+    rate_limiter = RateLimiter(max_requests_per_second)
+    outcomes = []
+    with open(outcomes_path, 'w', newline='') as outcomes_file, person_cache.PersonCache() as cache, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        writer = csv.DictWriter(outcomes_file, fieldnames=OUTCOME_FIELDS)
+        writer.writeheader()
+
+        def collect(done):
+            # The cached Pure json of a person is outdated once it is written, or a write was attempted.
+            cache.invalidate([future.result()['uuid'] for future in done])
+            for future in done:
+                outcome = future.result()
+                outcomes.append(outcome)
+                writer.writerow(outcome)
+                if outcome['error']:
+                    print(f"Failed to update {outcome['uuid']}. Status: {outcome['status']}")
+                elif on_success is not None:
+                    on_success(outcome['uuid'])
+                if len(outcomes) % 50 == 0:
+                    print(len(outcomes), '(' + time.strftime('%H:%M') + ')  ', end='', flush=True)
+            outcomes_file.flush()
+
+        # Keep only a few persons in flight, so a generator is not read ahead of the writers.
+        pending = set()
+        for data in persons:
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(put_person, data, rate_limiter))
+        collect(wait(pending).done)
+
+    failed = sum(1 for outcome in outcomes if outcome['error'])
+    latencies = sorted(outcome['latency'] for outcome in outcomes)
+    print(f'\nupdated {len(outcomes) - failed} persons, {failed} failed')
+    if latencies:
+        print(f'latency median {latencies[len(latencies) // 2]}s, max {latencies[-1]}s, '
+              f'outcomes written to {outcomes_path}')
+    return outcomes
@@ -0,0 +1,106 @@
+import json
+import math
+
+import settings
+
+try:
+    import orjson
+except ImportError:  # Without orjson the standard library encoder is used.
+    orjson = None
+
+NAN_POLICIES = ('null', 'reject')
+DEFAULT_NAN_POLICY = 'null'   # replace NaN by null; 'reject' refuses to serialize the person
+
+
+class SerializationError(ValueError):
+    """A value could not be serialized, e.g. NaN with the 'reject' policy."""
+
+
+def nan_policy() -> str:
+    """
+    :return: What to do with NaN values: 'null' replaces them by null, 'reject' raises a
+             SerializationError. Read from 'nan_policy' in the [Pure] section of config.ini.
+    """
+    policy = settings.get_config().get('Pure', 'nan_policy', fallback='') or DEFAULT_NAN_POLICY
+    if policy not in NAN_POLICIES:
+        raise ValueError(f'nan_policy must be one of {", ".join(NAN_POLICIES)}, not {policy!r}')
+    return policy
+
+
+def _is_missing(obj) -> bool:
+    """True for a float NaN, numpy NaN, pandas NA or NaT."""
+    if isinstance(obj, float):
+        return math.isnan(obj)
+    return type(obj).__name__ in ('NAType', 'NaTType')
+
+
+def _default(obj):
+    """
+    Convert a value the json encoders do not know into one they do: numpy arrays and pandas
+    arrays into lists, numpy scalars into Python numbers and pandas NA into NaN, so the NaN
+    policy applies to it. Used by both encoders, so no separate pass over the data is needed.
+    """
+    if _is_missing(obj):
+        return float('nan')
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, 'item'):
+        return obj.item()
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _sanitize(obj, policy: str, path: str = ''):
+    """
+    :return: A copy of obj with only json types, NaN replaced by None according to the policy.
+    Only used when the encoder found a NaN, to apply the policy and report where it is.
+    """
+    if isinstance(obj, dict):
+        return {key: _sanitize(value, policy, f'{path}.{key}' if path else str(key)) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_sanitize(value, policy, f'{path}[{index}]') for index, value in enumerate(obj)]
+    if obj is None or isinstance(obj, (str, bool, int)):
+        return obj
+    if not isinstance(obj, float):
+        return _sanitize(_default(obj), policy, path)
+    if math.isnan(obj) or math.isinf(obj):
+        if policy == 'reject':
+            raise SerializationError(f'{obj} value found at: {path}')
+        return None
+    return obj
+
+
+def dumps(obj, policy: str = None) -> bytes:
+    """
+    Serialize a json document in a single pass, converting numpy and pandas values on the way.
+
+    :param obj: A json document that may contain numpy arrays and scalars, pandas NA and NaN.
+    :param policy: What to do with NaN values, see nan_policy(). Defaults to the configured policy.
+    :return: The document as utf-8 encoded json bytes, e.g. the body of a request.
+    """
+    if policy is None:
+        policy = nan_policy()
+    if orjson is not None and policy == 'null':
+        # orjson writes NaN as null itself, and numpy arrays natively.
+        try:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+        except orjson.JSONEncodeError as e:
+            raise SerializationError(str(e)) from e
+    try:
+        return json.dumps(obj, default=_default, allow_nan=False, ensure_ascii=False).encode('utf-8')
+    except TypeError as e:
+        raise SerializationError(str(e)) from e
+    except ValueError:
+        # A NaN or infinity was found; it is rare, so only then walk the document to apply the policy.
+        return json.dumps(_sanitize(obj, policy), ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    """
+    :param data: json as bytes or str.
+    :return: The parsed document, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,22 @@
+import configparser
+import functools
+import os
+
+CONFIG_FILE = 'config.ini'
+
+# Define the file paths relative to the script's location. Every module reads them from here
+# when it needs them, so they can be pointed elsewhere in one place, e.g. by the benchmark.
+project_root = os.path.dirname(os.path.dirname(__file__))  # Go up one level from src/
+files_dir = os.path.join(project_root, 'files')
+photos_dir = os.path.join(project_root, 'photos')
+
+
+@functools.lru_cache(maxsize=None)
+def get_config() -> configparser.ConfigParser:
+    """Read config.ini once and return the parsed configuration.
+
+    :return: the configuration, shared by all modules.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    return config
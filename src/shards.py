@@ -0,0 +1,220 @@
+"""
+Update all persons in Pure in shards. The uustaff_results table is split by a stable hash of the
+uuid, so every person belongs to exactly one shard, on every host. Run all shards in a process pool:
+
+    python src/shards.py --shards 4
+
+or one shard per invocation, e.g. on several hosts that share the files directory:
+
+    python src/shards.py --shards 4 --shard 0
+    python src/shards.py --shards 4 --merge
+
+Each shard has its own journal, json file and outcome file; --merge combines the outcome files.
+The local cache of Pure persons is an SQLite database that cannot be shared between hosts, so a
+single shard only uses it when 'person_cache_path' in config.ini points to a local disk of the host.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import metrics
+import person_cache
+import pure_writer
+import settings
+import storage
+import update_pure
+
+SHARDS_DIRNAME = 'shards'
+REPORT_FILENAME = 'update_report.json'
+
+
+def shard_of(uuid: str, shard_count: int) -> int:
+    """
+    :param uuid: The uuid of a person.
+    :param shard_count: The number of shards.
+    :return: The shard of the person. Unlike hash(), this is the same in every process and on every host.
+    """
+    return int(hashlib.sha1(uuid.encode('utf-8')).hexdigest()[:8], 16) % shard_count
+
+
+def shard_dir(shard: int, shard_count: int) -> str:
+    """
+    :return: The directory with the journal, json file and outcome file of a shard.
+    """
+    return os.path.join(settings.files_dir, SHARDS_DIRNAME, f'{shard_count}_shards', f'shard_{shard}')
+
+
+def select_shard(merged_df, shard: int, shard_count: int):
+    """
+    :param merged_df: The DataFrame of the uustaff_results table.
+    :return: The rows of merged_df whose uuid belongs to the shard. Rows without uuid belong to no shard.
+    """
+    in_shard = merged_df['UUID'].map(
+        lambda uuid: isinstance(uuid, str) and bool(uuid) and shard_of(uuid, shard_count) == shard).astype(bool)
+    return merged_df[in_shard]
+
+
+def run_shard(shard: int, shard_count: int, resume: bool = False, max_requests_per_second: float = None,
+              share_rate_limit: bool = False, use_cache: bool = True) -> dict:
+    """
+    Update the persons of one shard in Pure. Can run in a separate process or on another host.
+
+    :param shard: The number of the shard, from 0 to shard_count - 1.
+    :param shard_count: The number of shards.
+    :param resume: If True, continue the journal of an interrupted run of this shard.
+    :param max_requests_per_second: The ceiling for the PUT rate of this shard. Defaults to the
+                                    configured ceiling, so the total rate grows with the number of shards.
+    :param share_rate_limit: If True and max_requests_per_second is not given, the shards share the
+                             configured ceiling: each gets the ceiling divided by the number of shards.
+    :param use_cache: If False, fetch every person from Pure and do not use the local cache of Pure
+                      persons, e.g. when it would be on a directory shared with other hosts.
+    :return: The number of persons in the shard, of PUTs and of failed PUTs.
+    """
+    if max_requests_per_second is None:
+        max_requests_per_second = settings.get_config().getfloat(
+            'Pure', 'write_max_requests_per_second', fallback=pure_writer.PURE_WRITE_MAX_REQUESTS_PER_SECOND)
+        if share_rate_limit:
+            max_requests_per_second /= shard_count
+    person_cache.enabled = use_cache
+    merged_df = select_shard(storage.read_table(storage.table_path('uustaff_results'),
+                                                storage.UUSTAFF_RESULTS_SCHEMA), shard, shard_count)
+    directory = shard_dir(shard, shard_count)
+    os.makedirs(directory, exist_ok=True)
+    print(f'Shard {shard} of {shard_count}: {len(merged_df)} persons')
+
+    outcomes = update_pure.update_all_persons(
+        merged_df, resume=resume,
+        journal_path=os.path.join(directory, 'update_journal.ndjson'),
+        json_path=os.path.join(directory, 'input_for_pure.ndjson'),
+        outcomes_path=os.path.join(directory, 'update_outcomes.csv'),
+        max_requests_per_second=max_requests_per_second,
+    )
+    metrics.write_summary(f'update_pure_shard{shard}of{shard_count}')
+    return {'shard': shard, 'persons': len(merged_df), 'written': len(outcomes),
+            'failed': sum(1 for outcome in outcomes if outcome['error'])}
+
+
+def run_shards(shard_count: int, max_workers: int = None, resume: bool = False,
+               max_requests_per_second: float = None, share_rate_limit: bool = False) -> dict:
+    """
+    Update all persons, with every shard in its own process, and merge the outcomes.
+
+    :param shard_count: The number of shards.
+    :param max_workers: The number of processes, defaults to the number of shards.
+    :param resume: If True, continue the journals of an interrupted run.
+    :param max_requests_per_second: The ceiling for the PUT rate of each shard, see run_shard().
+    :param share_rate_limit: If True, the shards share the configured ceiling, see run_shard().
+    :return: The merged report, see merge_outcomes().
+    """
+    shard_numbers = range(shard_count)
+    with ProcessPoolExecutor(max_workers=max_workers or shard_count) as executor:
+        for result in executor.map(run_shard, shard_numbers, [shard_count] * shard_count,
+                                   [resume] * shard_count, [max_requests_per_second] * shard_count,
+                                   [share_rate_limit] * shard_count):
+            print(f"Shard {result['shard']} done: {result['persons']} persons, "
+                  f"{result['written']} written, {result['failed']} failed")
+    return merge_outcomes(shard_count)
+
+
+def merge_outcomes(shard_count: int) -> dict:
+    """
+    Combine the outcome files of all shards into files/update_outcomes.csv and a report in
+    files/update_report.json.
+
+    :param shard_count: The number of shards.
+    :return: The report: the number of PUTs per status, the failed uuids, the shards without
+             outcome file and the uuids that were written by more than one shard.
+    """
+    outcomes_path = os.path.join(settings.files_dir, 'update_outcomes.csv')
+    shards_by_uuid = {}
+    statuses = {}
+    failed_uuids = []
+    missing_shards = []
+    with open(outcomes_path, 'w', newline='') as outcomes_file:
+        writer = csv.DictWriter(outcomes_file, fieldnames=['shard'] + pure_writer.OUTCOME_FIELDS)
+        writer.writeheader()
+        for shard in range(shard_count):
+            shard_outcomes_path = os.path.join(shard_dir(shard, shard_count), 'update_outcomes.csv')
+            if not os.path.exists(shard_outcomes_path):
+                missing_shards.append(shard)
+                continue
+            with open(shard_outcomes_path, newline='') as shard_file:
+                for outcome in csv.DictReader(shard_file):
+                    writer.writerow({'shard': shard, **outcome})
+                    shards_by_uuid.setdefault(outcome['uuid'], []).append(shard)
+                    statuses[outcome['status']] = statuses.get(outcome['status'], 0) + 1
+                    if outcome['error']:
+                        failed_uuids.append(outcome['uuid'])
+
+    report = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'shards': shard_count,
+        'missing_shards': missing_shards,
+        'written': sum(statuses.values()),
+        'failed': len(failed_uuids),
+        'statuses': statuses,
+        'failed_uuids': failed_uuids,
+        'written_by_several_shards': {uuid: shards for uuid, shards in shards_by_uuid.items() if len(shards) > 1},
+    }
+    with open(os.path.join(settings.files_dir, REPORT_FILENAME), 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+    print(f"{report['written']} PUTs in {shard_count - len(missing_shards)} of {shard_count} shards, "
+          f"{report['failed']} failed, outcomes written to {outcomes_path}")
+    if missing_shards:
+        print(f'No outcomes yet for shards {missing_shards}')
+    if report['written_by_several_shards']:
+        print(f"Warning: {len(report['written_by_several_shards'])} persons were written by more than one shard")
+    return report
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Update all persons in Pure in shards, partitioned by uuid.')
+    parser.add_argument('--shards', type=int, required=True, help='the number of shards')
+    parser.add_argument('--shard', type=int,
+                        help='run only this shard (0 to shards - 1), e.g. one per host; by default all shards run')
+    parser.add_argument('--workers', type=int, help='processes when all shards run, defaults to the number of shards')
+    parser.add_argument('--max-requests-per-second', type=float,
+                        help='PUT rate ceiling per shard, defaults to the configured ceiling, so the total '
+                             'PUT rate grows with the number of shards')
+    parser.add_argument('--share-rate-limit', action='store_true',
+                        help='divide the configured PUT rate ceiling over the shards, so together they write '
+                             'no faster than a single process')
+    parser.add_argument('--resume', action='store_true', help='continue the journals of an interrupted run')
+    parser.add_argument('--merge', action='store_true', help='only merge the outcome files of the shards')
+    parser.add_argument('--yes', action='store_true', help='do not ask for confirmation')
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error('--shards must be at least 1')
+    if args.shard is not None and not 0 <= args.shard < args.shards:
+        parser.error(f'--shard must be between 0 and {args.shards - 1}')
+    return args
+
+
+def main():
+    args = parse_arguments()
+    if args.merge:
+        merge_outcomes(args.shards)
+        return
+    if not args.yes:
+        update_pure.confirm_update_all()
+    if args.shard is not None:
+        # A single shard may run on one of several hosts that share the files directory, and the
+        # cache database cannot live there. Use it only when it was put on a disk of this host.
+        use_cache = bool(settings.get_config().get('Pure', 'person_cache_path', fallback=''))
+        if not use_cache:
+            print("Not using the local cache of Pure persons: set 'person_cache_path' in config.ini to a file "
+                  "on a local disk of this host to use it")
+        run_shard(args.shard, args.shards, resume=args.resume, max_requests_per_second=args.max_requests_per_second,
+                  share_rate_limit=args.share_rate_limit, use_cache=use_cache)
+    else:
+        run_shards(args.shards, max_workers=args.workers, resume=args.resume,
+                   max_requests_per_second=args.max_requests_per_second, share_rate_limit=args.share_rate_limit)
+
+
+if __name__ == '__main__':
+    main()
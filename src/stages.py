@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import time
+from typing import Callable, NamedTuple
+
+import settings
+import storage
+
+CACHE_DIRNAME = 'stage_cache'
+
+
+def cache_dir() -> str:
+    """
+    :return: The directory with the cached outputs of the stages, in the files directory.
+    """
+    return os.path.join(settings.files_dir, CACHE_DIRNAME)
+
+
+class Stage(NamedTuple):
+    """
+    A step of the pipeline. 'run' is called with the outputs of the 'inputs' stages, in
+    that order. 'params' are the other values the output depends on. The output is cached
+    for 'ttl' seconds, as json or, if the stage has a 'schema', as a typed table (a pandas
+    DataFrame, see storage.write_table()).
+    """
+    name: str
+    run: Callable
+    inputs: tuple = ()
+    params: dict = {}
+    ttl: float = 24 * 3600
+    schema: dict = None
+
+
+def _output_path(stage: Stage) -> str:
+    if stage.schema is not None:
+        return os.path.join(cache_dir(), os.path.basename(storage.table_path(stage.name)))
+    return os.path.join(cache_dir(), stage.name + '.json')
+
+
+def _meta_path(stage: Stage) -> str:
+    return os.path.join(cache_dir(), stage.name + '.meta.json')
+
+
+def _file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _save_output(stage: Stage, output):
+    path = _output_path(stage)
+    if stage.schema is not None:
+        storage.write_table(output, path, stage.schema)
+        return
+    with open(path + '.tmp', 'w') as output_file:
+        json.dump(output, output_file)
+    os.replace(path + '.tmp', path)
+
+
+def _load_output(stage: Stage):
+    path = _output_path(stage)
+    if stage.schema is not None:
+        return storage.read_table(path, stage.schema)
+    with open(path, 'r') as output_file:
+        return json.load(output_file)
+
+
+def _load_meta(stage: Stage):
+    try:
+        with open(_meta_path(stage), 'r') as meta_file:
+            return json.load(meta_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def input_fingerprint(stage: Stage, output_hashes: dict) -> str:
+    """
+    :param stage: The stage.
+    :param output_hashes: The hashes of the outputs of the stages run before, by stage name.
+    :return: A fingerprint of everything the output of the stage depends on: its name, its
+             params and the outputs of its input stages.
+    """
+    inputs = [stage.name, stage.params, [output_hashes[name] for name in stage.inputs]]
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _run_reason(stage: Stage, fingerprint: str, meta: dict, force=(), skip=()):
+    """
+    :return: Why the stage has to run, or None if its cached output can be used.
+    """
+    has_cache = meta is not None and os.path.exists(_output_path(stage))
+    if stage.name in skip:
+        if not has_cache:
+            raise ValueError(f'Cannot skip stage {stage.name}: it has no cached output.')
+        return None
+    if 'all' in force or stage.name in force:
+        return 'forced'
+    if not has_cache:
+        return 'no cached output'
+    if meta['fingerprint'] != fingerprint:
+        return 'input changed'
+    if time.time() - meta['timestamp'] > stage.ttl:
+        return 'cache expired'
+    return None
+
+
+def plan_stages(stages: list, force=(), skip=()) -> dict:
+    """
+    Tell which stages run_stages() would run, without running any of them.
+
+    :param stages: The stages, each after the stages it takes input from.
+    :param force: Names of stages to run even if their cache is valid, or 'all'.
+    :param skip: Names of stages to take from the cache even if it is outdated.
+    :return: A dictionary from stage name to the reason it would run, or None if its cached output would be used.
+    """
+    plan = {}
+    output_hashes = {}
+    for stage in stages:
+        meta = _load_meta(stage)
+        reason = _run_reason(stage, input_fingerprint(stage, output_hashes), meta, force, skip)
+        if reason is None and stage.name not in skip and any(plan[name] for name in stage.inputs):
+            reason = 'input may change'
+        plan[stage.name] = reason
+        output_hashes[stage.name] = meta['output_hash'] if meta is not None else None
+    return plan
+
+
+def run_stages(stages: list, force=(), skip=()) -> dict:
+    """
+    Run the stages in order, reusing the cached output of a stage when its input fingerprint
+    did not change and the cache did not expire.
+
+    :param stages: The stages, each after the stages it takes input from.
+    :param force: Names of stages to run even if their cache is valid, or 'all'.
+    :param skip: Names of stages to take from the cache even if it is outdated.
+    :return: A dictionary with the output of every stage, by stage name.
+    """
+    os.makedirs(cache_dir(), exist_ok=True)
+    outputs = {}
+    output_hashes = {}
+    for stage in stages:
+        fingerprint = input_fingerprint(stage, output_hashes)
+        meta = _load_meta(stage)
+        reason = _run_reason(stage, fingerprint, meta, force, skip)
+        if reason is None:
+            status = 'skipped' if stage.name in skip else 'up to date'
+            print(f'[stage {stage.name}] {status}, using cached output from {meta["created"]}')
+            outputs[stage.name] = _load_output(stage)
+            output_hashes[stage.name] = meta['output_hash']
+            continue
+
+        print(f'[stage {stage.name}] running: {reason}')
+        outputs[stage.name] = stage.run(*[outputs[name] for name in stage.inputs])
+        _save_output(stage, outputs[stage.name])
+        output_hashes[stage.name] = _file_hash(_output_path(stage))
+        with open(_meta_path(stage), 'w') as meta_file:
+            json.dump({'fingerprint': fingerprint,
+                       'output_hash': output_hashes[stage.name],
+                       'timestamp': time.time(),
+                       'created': time.strftime('%Y-%m-%d %H:%M:%S')}, meta_file)
+    return outputs
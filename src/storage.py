@@ -0,0 +1,108 @@
+import os
+
+import pandas as pd
+
+import settings
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # pyarrow is optional, without it tables are stored as csv.
+    pa = None
+
+
+# The columns of the intermediate tables and their types: 'string' or 'boolean'.
+# Both are pandas nullable types, so a missing value is always pd.NA.
+ACTIVE_PERSONS_SCHEMA = {
+    'uuid': 'string',
+    'employee_id': 'string',
+}
+UUSTAFF_RESULTS_SCHEMA = {
+    'SOLIS_ID': 'string',
+    'UUID': 'string',
+    'Email': 'string',
+    'DescriptionEN': 'string',
+    'DescriptionNL': 'string',
+    'UrlProfielfoto': 'string',
+    'UrlEN': 'string',
+    'ToestemmingProfielfotoInExterneApps': 'boolean',
+    'UUSTAFF_PAGE_ID': 'string',
+}
+
+_ARROW_TYPES = {'string': pa.string(), 'boolean': pa.bool_()} if pa is not None else {}
+_BOOLEAN_TEXT = {'true': True, 'false': False}
+# Text that stands for a missing value. 'None' and 'nan' are what str() made of a missing value in
+# tables harvested before, and what pd.read_csv used to read as missing.
+_MISSING_TEXT = ['', 'None', 'nan', 'NaN']
+
+
+def table_path(name: str) -> str:
+    """
+    :param name: The name of the table, e.g. 'uustaff_results'.
+    :return: The path of the table in the files directory, a .feather file or a .csv file without pyarrow.
+    """
+    return os.path.join(settings.files_dir, name + ('.feather' if pa is not None else '.csv'))
+
+
+def _to_boolean(value):
+    if isinstance(value, str):
+        return _BOOLEAN_TEXT.get(value.strip().lower(), pd.NA)
+    if value is None or value is pd.NA or (isinstance(value, float) and value != value):
+        return pd.NA
+    return bool(value)
+
+
+def coerce(df, schema: dict):
+    """
+    :param df: A DataFrame.
+    :param schema: The columns and their types, e.g. UUSTAFF_RESULTS_SCHEMA.
+    :return: A DataFrame with exactly the columns of the schema, in that order, converted to their
+             types. Empty strings, 'None', NaN and 'nan' become pd.NA, 'True'/'False' text becomes a boolean.
+    """
+    columns = {}
+    for column, dtype in schema.items():
+        values = df[column] if column in df else pd.Series([pd.NA] * len(df), index=df.index, dtype='object')
+        if dtype == 'boolean':
+            columns[column] = values.map(_to_boolean).astype('boolean')
+        else:
+            columns[column] = values.astype('string').replace(_MISSING_TEXT, pd.NA)
+    return pd.DataFrame(columns, index=df.index).reset_index(drop=True)
+
+
+def write_table(df, path: str, schema: dict):
+    """
+    Write a DataFrame with an explicit schema, to a temporary file first so readers never see a half
+    written table. Feather files are written uncompressed, so they can be memory mapped.
+
+    :param df: The DataFrame.
+    :param path: The file, see table_path().
+    :param schema: The columns and their types.
+    """
+    df = coerce(df, schema)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if path.endswith('.feather'):
+        arrow_schema = pa.schema([(column, _ARROW_TYPES[dtype]) for column, dtype in schema.items()])
+        table = pa.Table.from_pandas(df, schema=arrow_schema, preserve_index=False)
+        feather.write_feather(table, path + '.tmp', compression='uncompressed')
+    else:
+        df.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+def read_table(path: str, schema: dict, columns: list = None):
+    """
+    :param path: The file, see table_path().
+    :param schema: The columns and their types.
+    :param columns: Only read these columns, defaults to all columns of the schema.
+    :return: The DataFrame, with the types of the schema.
+    """
+    schema = {column: schema[column] for column in (columns or schema)}
+    if path.endswith('.feather'):
+        table = feather.read_table(path, columns=list(schema), memory_map=True)
+        df = table.to_pandas(types_mapper={pa.string(): pd.StringDtype(),
+                                           pa.bool_(): pd.BooleanDtype()}.get)
+        # Tables written before 'None' was treated as missing may still contain it.
+        return coerce(df, schema)
+    # Read everything as text first, so the schema decides about the types and not pandas.
+    df = pd.read_csv(path, usecols=list(schema), dtype=str, keep_default_na=False)
+    return coerce(df, schema)
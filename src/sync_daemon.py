@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import harvestpp as pp
+import journal
+import metrics
+import pipeline
+import settings
+import stages
+
+SYNC_INTERVAL_MINUTES = 15      # time between the start of two cycles
+SYNC_JOURNAL_FILENAME = 'sync_journal.ndjson'
+SYNC_INPUT_FILENAME = 'sync_input_for_pure.ndjson'
+SYNC_OUTCOMES_FILENAME = 'sync_outcomes.csv'
+SYNC_STATUS_FILENAME = 'sync_status.json'
+# The persons changed in Pure that were not written or found unchanged yet. The snapshot of the
+# active persons only lists the changes since the previous harvest, so they are kept here until
+# each of them is journaled, also when a cycle or the daemon stops halfway.
+SYNC_PENDING_FILENAME = 'sync_pending_in_pure.json'
+
+
+class SyncDaemon:
+    """
+    Harvests the staff pages and updates Pure in cycles, without asking for confirmation. The
+    http session, the journal of written payloads and the other caches of the modules stay in
+    memory between cycles, and only persons whose staff page data or Pure record changed since
+    they were last written are fetched from Pure and updated.
+    """
+
+    def __init__(self, interval_minutes: float):
+        """
+        :param interval_minutes: The time between the start of two cycles.
+        """
+        self.interval = interval_minutes * 60
+        self.stopped = threading.Event()
+        self.journal = journal.UpdateJournal(os.path.join(settings.files_dir, SYNC_JOURNAL_FILENAME), resume=True)
+        self.pending_in_pure = self._load_pending()
+        self._status_lock = threading.Lock()
+        self._status = {'state': 'starting', 'started': datetime.now().isoformat(timespec='seconds'),
+                        'interval_minutes': interval_minutes, 'cycles': 0, 'failed_cycles': 0,
+                        'last_cycle': None, 'next_cycle': None}
+
+    def status(self) -> dict:
+        """
+        :return: The state of the daemon and the statistics of the last cycle.
+        """
+        with self._status_lock:
+            return json.loads(json.dumps(self._status))
+
+    def _set_status(self, **changes):
+        """Update the status and write it to files/sync_status.json, through a temporary file."""
+        with self._status_lock:
+            self._status.update(changes)
+            data = json.dumps(self._status, indent=2)
+        os.makedirs(settings.files_dir, exist_ok=True)
+        status_path = os.path.join(settings.files_dir, SYNC_STATUS_FILENAME)
+        with open(status_path + '.tmp', 'w') as status_file:
+            status_file.write(data)
+        os.replace(status_path + '.tmp', status_path)
+
+    def _load_pending(self) -> set:
+        """
+        :return: The uuids changed in Pure that an earlier run did not process, see SYNC_PENDING_FILENAME.
+        """
+        pending_path = os.path.join(settings.files_dir, SYNC_PENDING_FILENAME)
+        if not os.path.exists(pending_path):
+            return set()
+        with open(pending_path) as pending_file:
+            return set(json.load(pending_file))
+
+    def _save_pending(self):
+        """Write the uuids changed in Pure that were not processed yet, through a temporary file."""
+        os.makedirs(settings.files_dir, exist_ok=True)
+        pending_path = os.path.join(settings.files_dir, SYNC_PENDING_FILENAME)
+        with open(pending_path + '.tmp', 'w') as pending_file:
+            json.dump(sorted(self.pending_in_pure), pending_file)
+        os.replace(pending_path + '.tmp', pending_path)
+
+    def run_cycle(self) -> dict:
+        """
+        Harvest the changes and write the persons that need it to Pure.
+
+        :return: The statistics of the cycle.
+        """
+        started = time.time()
+        # Active persons are harvested incrementally through the snapshot and the staff pages are
+        # compared with the previous cycle, so both stages run every cycle.
+        try:
+            outputs = stages.run_stages(pp.harvest_stages(), force=['persons', 'connect'])
+        finally:
+            # The persons stage overwrites the changes in the snapshot, so keep them before a later stage fails.
+            self.pending_in_pure.update(pp.load_active_persons_snapshot()['changed_uuids'])
+            self._save_pending()
+        merged_df = outputs['photos']
+
+        payload_hashes = {row['UUID']: pp.payload_hash(row) for row in merged_df.to_dict('records')}
+        # A person that is not on the staff pages (anymore) is not updated, so it is not kept either.
+        self.pending_in_pure &= payload_hashes.keys()
+        changed_in_pure = set(self.pending_in_pure)
+        changed_in_pp = {uuid for uuid, payload_hash in payload_hashes.items()
+                         if isinstance(uuid, str) and not self.journal.is_committed(uuid, payload_hash)}
+        to_update = changed_in_pp | changed_in_pure
+        print(f'{len(changed_in_pp)} persons changed on the staff pages, {len(changed_in_pure)} in Pure, '
+              f'{len(to_update)} to update')
+
+        outcomes = []
+        if to_update:
+            def record(uuid):
+                self.journal.record(uuid, payload_hashes.get(uuid))
+                self.pending_in_pure.discard(uuid)
+
+            try:
+                outcomes = pipeline.stream_update(merged_df[merged_df['UUID'].isin(list(to_update))],
+                                                  on_success=record, on_unchanged=record,
+                                                  json_path=os.path.join(settings.files_dir, SYNC_INPUT_FILENAME),
+                                                  outcomes_path=os.path.join(settings.files_dir, SYNC_OUTCOMES_FILENAME))
+            finally:
+                # Persons that failed or were not reached stay pending for the next cycle.
+                self._save_pending()
+        else:
+            self._save_pending()
+        return {
+            'started': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+            'seconds': round(time.time() - started, 1),
+            'persons': len(payload_hashes),
+            'changed_in_pp': len(changed_in_pp),
+            'changed_in_pure': len(changed_in_pure),
+            'updated': len(to_update),
+            'pending_in_pure': len(self.pending_in_pure),
+            'written': len(outcomes),
+            'failed': sum(1 for outcome in outcomes if outcome['error']),
+            'error': None,
+        }
+
+    def run(self, once: bool = False):
+        """
+        Run cycles until stop() is called. A cycle that fails is reported in the status, and
+        the next cycle runs as planned.
+
+        :param once: If True, run a single cycle.
+        """
+        while not self.stopped.is_set():
+            next_start = time.time() + self.interval
+            self._set_status(state='running')
+            failed = 0
+            try:
+                cycle = self.run_cycle()
+            except Exception as e:
+                print(f'Sync cycle failed: {e!r}')
+                cycle = {'started': datetime.now().isoformat(timespec='seconds'), 'error': repr(e)}
+                failed = 1
+            next_cycle = None if once else datetime.fromtimestamp(next_start).isoformat(timespec='seconds')
+            self._set_status(state='idle', cycles=self._status['cycles'] + 1,
+                             failed_cycles=self._status['failed_cycles'] + failed,
+                             last_cycle=cycle, next_cycle=next_cycle, endpoints=metrics.summary()['endpoints'])
+            if once:
+                break
+            self.stopped.wait(max(0, next_start - time.time()))
+        self._set_status(state='stopped', next_cycle=None)
+        self.journal.close()
+
+    def stop(self, *args):
+        """Stop after the current cycle. Can be used as a signal handler."""
+        print('Stopping after the current cycle')
+        self.stopped.set()
+
+
+def serve_status(daemon: SyncDaemon, port: int) -> ThreadingHTTPServer:
+    """
+    Serve the status of the daemon as json on /status and the metrics in the Prometheus text
+    format on /metrics, in a background thread.
+
+    :return: The server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/status':
+                body, content_type = json.dumps(daemon.status(), indent=2).encode('utf-8'), 'application/json'
+            elif self.path == '/metrics':
+                body, content_type = metrics.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Status on http://localhost:{port}/status and /metrics')
+    return server
+
+
+def parse_arguments():
+    config = settings.get_config()
+    status_port = config.get('Sync', 'status_port', fallback='')
+    parser = argparse.ArgumentParser(description='Keep Pure in sync with the UU staff pages, without interaction.')
+    parser.add_argument('--interval-minutes', type=float,
+                        default=config.getfloat('Sync', 'interval_minutes', fallback=SYNC_INTERVAL_MINUTES),
+                        help='time between the start of two cycles')
+    parser.add_argument('--status-port', type=int,
+                        default=int(status_port) if status_port else None,
+                        help='serve the status and metrics over http on this port')
+    parser.add_argument('--once', action='store_true', help='run a single cycle and stop')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    daemon = SyncDaemon(args.interval_minutes)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    if args.status_port:
+        serve_status(daemon, args.status_port)
+    daemon.run(once=args.once)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,87 +1,62 @@
-import requests
+import json
 import os
-import pathlib
-import configparser
-import harvestpp as pp
-import pandas as pd
 from datetime import datetime, time
-import numpy as np
-import math
-import json
-import logging
-config = configparser.ConfigParser()
-config.read('config.ini')
 
-API_KEY_CRUD = config['Pure']['pure_api_key_crud']
-API_NEW_BASE = config['Pure']['api_url_base']
+import journal
+import metrics
+import patch_rules
+import person_cache
+import person_index
+import pure_api
+import pure_writer
+import settings
+
+# harvestpp, pipeline, storage and pandas are imported only by the functions that need them,
+# so updating a single person starts without loading pandas or the harvest.
 
-# Define the file path relative to the script's location
-project_root = os.path.dirname(os.path.dirname(__file__))  # Go up one level from src/
-files_dir = os.path.join(project_root, 'files')
 
-def convert_ndarrays(obj):
+def read_json(json_path=None):
     """
-       :param obj: An object that may contain nested dictionaries, lists, and NumPy arrays.
-       :return: An object with the same structure as input but with all NumPy arrays converted to lists.
-       """
-    if isinstance(obj, dict):
-        return {key: convert_ndarrays(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_ndarrays(element) for element in obj]
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    else:
-        return obj
-
-headers = {
-    "accept": "application/json",
-    "api-key": API_KEY_CRUD,
-    "content-type": "application/json"
-}
-
-def update_persons(updated_response_json):
+    :param json_path: The file with one person json per line, defaults to files/input_for_pure2.ndjson.
+    :return: A generator of the person jsons in the file. Only one line is in memory at a time,
+             and a line that was cut off by an interrupted run is skipped.
     """
-        :param updated_response_json: JSON data that includes potentially nested dictionary or list structures which may contain NaN values and needs updating.
-        :return: None. Updates `updated_response_json` in place and sends PUT requests to update person records.
-        """
-
-    def find_nan(data, path=""):
-        """Recursively find and print where NaN values are in the data."""
-        if isinstance(data, dict):
-            for key, value in data.items():
-                new_path = f"{path}.{key}" if path else key
-                find_nan(value, new_path)
-        elif isinstance(data, list):
-            for index, value in enumerate(data):
-                new_path = f"{path}[{index}]"
-                find_nan(value, new_path)
-        elif isinstance(data, float) and math.isnan(data):
-            print(f"NaN value found at: {path}")
-
-    find_nan((updated_response_json))
-
-    updated_response_json = json.loads(updated_response_json)
-    for data in updated_response_json['results']:
-        data = convert_ndarrays(data)
-
-        api_url = API_NEW_BASE + 'persons/' + data['uuid']
-        response = requests.put(api_url, headers=headers, json=data)
-
-
-
-def read_json():
-    # Load JSON data from file
-    json_path = os.path.join(files_dir, 'input_for_pure2.json')
+    if json_path is None:
+        import harvestpp as pp
+        json_path = os.path.join(settings.files_dir, pp.INPUT_FOR_PURE_FILENAME)
     try:
         with open(json_path, 'r') as json_file:
-            uustaff = json.load(json_file)
-        # print(f"Data read from JSON: {uustaff}")
+            for line in json_file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    print(f"Error decoding JSON: {e}")
     except FileNotFoundError:
         print(f"File not found: {json_path}")
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
-    file_path = "uustaff_harvest.json"
-    return uustaff
+
+
+def read_person_json(uuid, json_path=None):
+    """
+    :param uuid: The uuid of the person.
+    :param json_path: The file with one person json per line, defaults to files/input_for_pure2.ndjson.
+    :return: The json of the person, or None if it is not in the file. Only the line of the person is parsed.
+    """
+    if json_path is None:
+        import harvestpp as pp
+        json_path = os.path.join(settings.files_dir, pp.INPUT_FOR_PURE_FILENAME)
+    # serializer.dumps() writes compact json with orjson and spaced json without it.
+    markers = [json.dumps({'uuid': uuid}, separators=separators)[1:-1] for separators in ((',', ':'), (', ', ': '))]
+    with open(json_path, 'r') as json_file:
+        for line in json_file:
+            if not any(marker in line for marker in markers):
+                continue
+            try:
+                person = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if person.get('uuid') == uuid:
+                return person
+    return None
 
 
 def print_summary():
@@ -98,21 +73,25 @@ def print_summary():
 
     1. Update all persons
     2. Update a single person (using solisid)
+    3. Resume an interrupted update of all persons
     """
     print(summary)
 
 def get_user_choice():
     while True:
-        user_input = input("Enter your choice (1 for all persons, 2 for single solisid): ").strip()
+        user_input = input("Enter your choice (1 for all persons, 2 for single solisid, 3 to resume): ").strip()
         if user_input == '1':
             print("You have chosen to update all persons.\n")
             return 'all'
+        elif user_input == '3':
+            print("You have chosen to resume the interrupted update.\n")
+            return 'resume'
         elif user_input == '2':
             solisid = input("Enter the solisid of the person you want to update: ").strip()
             print(f"You have chosen to update the person with solisid: {solisid}\n")
             return solisid
         else:
-            print("Invalid input. Please enter '1' for all persons or '2' for a single solisid.")
+            print("Invalid input. Please enter '1' for all persons, '2' for a single solisid or '3' to resume.")
 
 
 def confirm_update_all():
@@ -128,39 +107,115 @@ def confirm_update_all():
             print("Invalid input. Please enter 'y' to proceed or 'n' to stop:")
 
 
-def main():
-    print_summary()
-    user_choice = get_user_choice()
-    # Read the CSV file into a DataFrame
-    # Define the path to the saved merged DataFrame
-    output_path = os.path.join(files_dir, 'uustaff_results.csv')
+def load_uustaff_results():
+    """
+    :return: The DataFrame of the uustaff_results table written by harvestpp.py. Exits if it cannot be read.
+    """
+    import pandas as pd
+    import storage
+
+    # Read the typed table written by harvestpp.py into a DataFrame
+    output_path = storage.table_path('uustaff_results')
     try:
-        merged_df = pd.read_csv(output_path)
+        merged_df = storage.read_table(output_path, storage.UUSTAFF_RESULTS_SCHEMA)
         print("DataFrame successfully loaded.")
     except FileNotFoundError:
         print(f"File not found: {output_path}")
-        exit
+        exit(1)
     except pd.errors.EmptyDataError as e:
         print(f"Error reading CSV file: {e}")
-        exit
-    if user_choice == 'all':
-        if confirm_update_all():
-        # Call the function that handles updating all persons
+        exit(1)
+    return merged_df
 
-            persons_pure_json = pp.fetch_person_data(merged_df)
-            updated_response_json = pp.update_profile_information(merged_df, persons_pure_json)
-            pp.update_persons(updated_response_json)
-    else:
-        # Filter the DataFrame based on 'solisid' column
-        merged_df['SOLIS_ID'] = merged_df['SOLIS_ID'].astype(str)
-        filtered_df = merged_df[merged_df['SOLIS_ID'] == user_choice]
 
-        if filtered_df.empty:
-            print('no person found in csv')
-        else:
-            persons_pure_json = pp.fetch_person_data(filtered_df)
-            updated_response_json = pp.update_profile_information(filtered_df, persons_pure_json)
-            pp.update_persons(updated_response_json)
+def update_all_persons(merged_df, resume=False, journal_path=None, dry_run=False, **stream_options):
+    """
+    :param merged_df: The DataFrame of the uustaff_results table.
+    :param resume: If True, skip the persons that the journal of the previous run lists with an
+                   identical payload. Otherwise a new journal is started.
+    :param journal_path: The journal file, defaults to files/update_journal.ndjson.
+    :param dry_run: If True, compare the persons with Pure but write neither Pure nor the journal.
+    :param stream_options: Passed on to pipeline.stream_update(), e.g. the outcomes_path of a shard.
+    :return: A list with the outcome of every PUT, see pure_writer.put_person(). Every person
+             that is up to date in Pure afterwards is recorded in the journal.
+    """
+    import harvestpp as pp
+    import pipeline
+
+    payload_hashes = {row['UUID']: pp.payload_hash(row) for row in merged_df.to_dict('records')}
+    with journal.UpdateJournal(journal_path, resume=resume, dry_run=dry_run) as update_journal:
+        if resume:
+            done = merged_df['UUID'].map(
+                lambda uuid: update_journal.is_committed(uuid, payload_hashes.get(uuid))).astype(bool)
+            print(f'Resuming: {done.sum()} persons were already updated, {(~done).sum()} remaining.')
+            merged_df = merged_df[~done]
+            if merged_df.empty:
+                return []
+
+        # Persons without changes are as up to date as the ones that are written.
+        def record(uuid):
+            update_journal.record(uuid, payload_hashes.get(uuid))
+
+        # Fetch, update and write the persons chunk by chunk, so memory use does not
+        # grow with the number of persons.
+        return pipeline.stream_update(merged_df, on_success=record, on_unchanged=record, dry_run=dry_run,
+                                      **stream_options)
+
+
+def update_single_person(solisid, dry_run=False):
+    """
+    Update one person, found through the SOLIS_ID index instead of the whole uustaff_results table.
+
+    :param solisid: The SolisID of the person.
+    :param dry_run: If True, only print what would change.
+    :return: The outcome of the PUT, see pure_writer.put_person(), or None if nothing was written.
+    """
+    try:
+        row = person_index.lookup_solis_id(solisid)
+    except FileNotFoundError:
+        # Harvested before there was an index: build it once from the table.
+        person_index.build_index(load_uustaff_results())
+        row = person_index.lookup_solis_id(solisid)
+    if row is None or not row['UUID']:
+        print('no person found in uustaff_results')
+        return None
+
+    persons = pure_api.search_persons([row['UUID']])
+    if not persons:
+        print(f"person {row['UUID']} not found in Pure")
+        return None
+    person = persons[0]
+    original = patch_rules.person_fields(person)
+    patch_rules.apply_profile_updates(person, row, datetime.combine(datetime.now().date(), time()))
+    changes = patch_rules.changed_fields(original, person)
+    if not changes:
+        print('Pure is already up to date for this person')
+        return None
+
+    print('Changed: ' + ', '.join(changes))
+    if dry_run:
+        print(f"Dry run: {person['uuid']} is not written to Pure")
+        return None
+    outcome = pure_writer.put_person(person, pure_writer.RateLimiter(1))
+    with person_cache.PersonCache() as cache:
+        cache.invalidate([outcome['uuid']])
+    print(f"update of {outcome['uuid']}: status {outcome['status']} in {outcome['latency']}s {outcome['error']}")
+    return outcome
+
+
+def main():
+    print_summary()
+    user_choice = get_user_choice()
+    if user_choice not in ('all', 'resume'):
+        update_single_person(user_choice)
+        metrics.write_summary('update_pure')
+        return
+
+    merged_df = load_uustaff_results()
+    if confirm_update_all():
+        # Call the function that handles updating all persons
+        update_all_persons(merged_df, resume=user_choice == 'resume')
+        metrics.write_summary('update_pure')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
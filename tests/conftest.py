@@ -0,0 +1,23 @@
+import os
+import sys
+
+# The modules in src/ import each other by name, like when a script is run from src/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import settings  # noqa: E402
+
+# The keys read when the modules are imported, so the tests run without a config.ini.
+settings.get_config().read_dict({
+    'Pure': {
+        'pure_api_key_crud': 'test',
+        'pure_api_key_old': 'test',
+        'api_url_persons_old': 'http://localhost/ws/api/persons',
+        'api_url_persons_search': 'http://localhost/ws/api/persons/search',
+        'api_url_base': 'http://localhost/ws/api/',
+        'uri_profile_en': '/dk/atira/pure/person/customfields/profiel_eng',
+    },
+    'PP': {
+        'api': 'http://localhost/pp',
+        'filestaff': 'uustaff_harvest.json',
+    },
+})
@@ -0,0 +1,146 @@
+"""
+The patch rules must produce the same Pure json as the hand-written update logic they replaced.
+The expected documents below are what that logic produced for the same person and row.
+"""
+import copy
+from datetime import datetime
+
+import patch_rules
+import photos
+
+REF_DATE = datetime(2024, 6, 1)
+URI_PROFILE = '/dk/atira/pure/person/customfields/profiel_eng'
+URI_LINK = '/dk/atira/pure/person/customfields/profiel_url'
+LINK_TERM = 'Link to Utrecht University staff page'
+STAFF_PAGE = 'https://www.uu.nl/staff/JJansen'
+LINK = f'<p><a href="{STAFF_PAGE}">{STAFF_PAGE}</a></p>'
+PAYLOAD = {'fileData': 'aGVsbG8=', 'size': 5, 'sha256': 'x'}
+
+
+def make_row(**values):
+    row = {'SOLIS_ID': '1234567', 'UUID': 'uuid-1', 'Email': 'new@uu.nl', 'DescriptionEN': 'English bio',
+           'DescriptionNL': 'Nederlandse bio', 'UrlEN': STAFF_PAGE,
+           'UrlProfielfoto': None, 'ToestemmingProfielfotoInExterneApps': True, 'UUSTAFF_PAGE_ID': 'JJansen'}
+    row.update(values)
+    return row
+
+
+def info(term, uri, value):
+    return {'value': {'en_GB': value}, 'type': {'uri': uri, 'term': {'en_GB': term}}}
+
+
+def email(value):
+    return {'value': value,
+            'type': {'uri': '/dk/atira/pure/person/personemailtype/email', 'term': {'en_GB': 'Email'}}}
+
+
+def association(start, end=None, emails=None):
+    result = {'period': {'startDate': start, **({'endDate': end} if end else {})}}
+    if emails is not None:
+        result['emails'] = emails
+    return result
+
+
+def apply(person, row):
+    person = copy.deepcopy(person)
+    patch_rules.apply_profile_updates(person, row, REF_DATE)
+    return person
+
+
+def test_about_and_link_are_updated_in_place(monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: None)
+    person = {'uuid': 'uuid-1', 'profileInformation': [
+        info('Research', URI_PROFILE, 'research'),
+        info('About', URI_PROFILE, 'old bio'),
+        info(LINK_TERM, URI_LINK, '<p>old link</p>'),
+    ]}
+
+    assert apply(person, make_row())['profileInformation'] == [
+        info('Research', URI_PROFILE, 'research'),
+        info('About', URI_PROFILE, 'English bio'),
+        info(LINK_TERM, URI_LINK, LINK),
+    ]
+
+
+def test_about_and_link_are_inserted(monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: None)
+    person = {'uuid': 'uuid-1'}
+
+    # Without an English bio the Dutch one is used.
+    assert apply(person, make_row(DescriptionEN=None))['profileInformation'] == [
+        info('About', URI_PROFILE, 'Nederlandse bio'),
+        info(LINK_TERM, URI_LINK, LINK),
+    ]
+
+
+def test_missing_values_leave_the_person_alone(monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: None)
+    person = {'uuid': 'uuid-1', 'profileInformation': [info('About', URI_PROFILE, 'old bio')],
+              'staffOrganizationAssociations': [association('2020-01-01')]}
+    row = make_row(Email=None, DescriptionEN=None, DescriptionNL=None, UrlEN=None,
+                   ToestemmingProfielfotoInExterneApps=False)
+
+    assert apply(person, row) == person
+
+
+def test_email_is_added_to_the_current_association_without_email(monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: None)
+    person = {'uuid': 'uuid-1', 'staffOrganizationAssociations': [
+        association('2010-01-01', '2015-12-31'),
+        association('2020-01-01'),
+    ]}
+
+    assert apply(person, make_row())['staffOrganizationAssociations'] == [
+        association('2010-01-01', '2015-12-31'),
+        association('2020-01-01', emails=[email('new@uu.nl')]),
+    ]
+
+
+def test_existing_email_is_kept(monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: None)
+    person = {'uuid': 'uuid-1', 'staffOrganizationAssociations': [
+        association('2020-01-01', emails=[email('old@uu.nl')]),
+    ]}
+
+    assert apply(person, make_row())['staffOrganizationAssociations'] == person['staffOrganizationAssociations']
+
+
+def test_no_email_without_a_current_association(monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: None)
+    person = {'uuid': 'uuid-1', 'staffOrganizationAssociations': [association('2010-01-01', '2015-12-31')]}
+
+    assert apply(person, make_row())['staffOrganizationAssociations'] == person['staffOrganizationAssociations']
+
+
+def test_photo_is_added_with_consent(monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: PAYLOAD)
+
+    profile_photos = apply({'uuid': 'uuid-1'}, make_row())['profilePhotos']
+    assert len(profile_photos) == 1
+    assert profile_photos[0]['fileData'] == PAYLOAD['fileData']
+    assert profile_photos[0]['size'] == PAYLOAD['size']
+    assert profile_photos[0]['type']['uri'] == '/dk/atira/pure/person/personfiles/portrait'
+
+    assert 'profilePhotos' not in apply({'uuid': 'uuid-1'}, make_row(ToestemmingProfielfotoInExterneApps=False))
+
+
+def test_existing_photo_is_kept_without_reading_the_payload(monkeypatch):
+    def get_photo_payload(page_id):
+        raise AssertionError('the payload of a person with a photo is not needed')
+
+    monkeypatch.setattr(photos, 'get_photo_payload', get_photo_payload)
+    person = {'uuid': 'uuid-1', 'profilePhotos': [{'fileName': 'existing.jpg'}]}
+
+    assert apply(person, make_row())['profilePhotos'] == [{'fileName': 'existing.jpg'}]
+
+
+def test_changed_fields(monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: None)
+    person = {'uuid': 'uuid-1', 'profileInformation': [info('About', URI_PROFILE, 'English bio')]}
+    original = patch_rules.person_fields(person)
+
+    updated = apply(person, make_row(UrlEN=None))
+    assert patch_rules.changed_fields(original, updated) == []
+
+    updated = apply(person, make_row(DescriptionEN='New bio', UrlEN=None))
+    assert patch_rules.changed_fields(original, updated) == ['About']
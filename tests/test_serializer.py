@@ -0,0 +1,80 @@
+"""
+serializer.dumps() must give the same json with and without orjson, convert numpy and pandas
+values, and apply the NaN policy.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import serializer
+import update_pure
+
+DOCUMENT = {
+    'uuid': 'uuid-1',
+    'count': np.int64(3),
+    'share': np.float32(0.5),
+    'flag': np.bool_(True),
+    'ids': np.array([1, 2, 3]),
+    'name': 'Jansen, Ü',
+}
+EXPECTED = {'uuid': 'uuid-1', 'count': 3, 'share': 0.5, 'flag': True, 'ids': [1, 2, 3], 'name': 'Jansen, Ü'}
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def backend(request, monkeypatch):
+    if request.param == 'orjson':
+        if serializer.orjson is None:
+            pytest.skip('orjson is not installed')
+    else:
+        monkeypatch.setattr(serializer, 'orjson', None)
+    return request.param
+
+
+@pytest.mark.parametrize('policy', serializer.NAN_POLICIES)
+def test_numpy_values(backend, policy):
+    data = serializer.dumps(DOCUMENT, policy)
+    assert isinstance(data, bytes)
+    assert json.loads(data) == EXPECTED
+
+
+@pytest.mark.parametrize('missing', [float('nan'), np.float64('nan'), pd.NA, np.array([1.0, np.nan])])
+def test_null_policy_replaces_missing_values(backend, missing):
+    document = json.loads(serializer.dumps({'uuid': 'uuid-1', 'value': missing, 'nested': [{'value': missing}]},
+                                           'null'))
+    expected = [1.0, None] if isinstance(missing, np.ndarray) else None
+    assert document == {'uuid': 'uuid-1', 'value': expected, 'nested': [{'value': expected}]}
+
+
+@pytest.mark.parametrize('missing', [float('nan'), np.float64('nan'), pd.NA, np.array([1.0, np.nan])])
+def test_reject_policy_raises(backend, missing):
+    with pytest.raises(serializer.SerializationError, match='nested'):
+        serializer.dumps({'uuid': 'uuid-1', 'nested': [{'value': missing}]}, 'reject')
+
+
+def test_unknown_type_raises(backend):
+    with pytest.raises(serializer.SerializationError):
+        serializer.dumps({'value': object()}, 'null')
+
+
+def test_loads(backend):
+    assert serializer.loads(serializer.dumps(DOCUMENT, 'null')) == EXPECTED
+
+
+def test_read_person_json_from_both_backends(tmp_path, monkeypatch):
+    path = tmp_path / 'input_for_pure.ndjson'
+    lines = [json.dumps({'uuid': 'uuid-1', 'name': 'spaced'}).encode('utf-8'),
+             json.dumps({'name': 'compact', 'uuid': 'uuid-2'}, separators=(',', ':')).encode('utf-8')]
+    if serializer.orjson is not None:
+        lines.append(serializer.dumps({'uuid': 'uuid-3', 'name': 'orjson'}, 'null'))
+    monkeypatch.setattr(serializer, 'orjson', None)
+    lines.append(serializer.dumps({'uuid': 'uuid-4', 'name': 'json'}, 'null'))
+    path.write_bytes(b'\n'.join(lines) + b'\n')
+
+    assert update_pure.read_person_json('uuid-1', str(path))['name'] == 'spaced'
+    assert update_pure.read_person_json('uuid-2', str(path))['name'] == 'compact'
+    if len(lines) == 4:
+        assert update_pure.read_person_json('uuid-3', str(path))['name'] == 'orjson'
+    assert update_pure.read_person_json('uuid-4', str(path))['name'] == 'json'
+    assert update_pure.read_person_json('uuid-5', str(path)) is None
@@ -0,0 +1,90 @@
+"""
+The uustaff_results table must come back from Feather and from the csv fallback with the same
+types, and a missing value on the staff pages must never come back as text, e.g. 'None'.
+"""
+import pandas as pd
+import pytest
+
+import patch_rules
+import photos
+import storage
+
+SCHEMA = storage.UUSTAFF_RESULTS_SCHEMA
+ROWS = [
+    {'SOLIS_ID': '1', 'UUID': 'uuid-1', 'Email': 'a@uu.nl', 'DescriptionEN': 'bio', 'DescriptionNL': None,
+     'UrlProfielfoto': 'https://www.uu.nl/a.jpg', 'UrlEN': 'https://www.uu.nl/a',
+     'ToestemmingProfielfotoInExterneApps': 'True', 'UUSTAFF_PAGE_ID': 'a'},
+    {'SOLIS_ID': '2', 'UUID': 'uuid-2', 'Email': '', 'DescriptionEN': 'None', 'DescriptionNL': 'nl bio',
+     'UrlProfielfoto': 'nan', 'UrlEN': None,
+     'ToestemmingProfielfotoInExterneApps': 'False', 'UUSTAFF_PAGE_ID': 'b'},
+    {'SOLIS_ID': '3', 'UUID': 'uuid-3', 'Email': 'NaN', 'DescriptionEN': float('nan'), 'DescriptionNL': '',
+     'UrlProfielfoto': '', 'UrlEN': 'None',
+     'ToestemmingProfielfotoInExterneApps': None, 'UUSTAFF_PAGE_ID': 'c'},
+]
+
+needs_pyarrow = pytest.mark.skipif(storage.pa is None, reason='pyarrow is not installed')
+
+
+@pytest.fixture(params=[pytest.param('.feather', marks=needs_pyarrow), '.csv'])
+def table_path(request, tmp_path):
+    return str(tmp_path / ('uustaff_results' + request.param))
+
+
+def test_missing_values_and_booleans_round_trip(table_path):
+    storage.write_table(pd.DataFrame(ROWS), table_path, SCHEMA)
+    df = storage.read_table(table_path, SCHEMA)
+
+    assert list(df.columns) == list(SCHEMA)
+    assert df['DescriptionEN'].tolist()[0] == 'bio'
+    for column in ('Email', 'DescriptionEN', 'UrlProfielfoto', 'UrlEN'):
+        assert df[column].isna().tolist()[1:] == [True, True], column
+    assert df['DescriptionNL'].isna().tolist() == [True, False, True]
+    assert str(df['ToestemmingProfielfotoInExterneApps'].dtype) == 'boolean'
+    assert df['ToestemmingProfielfotoInExterneApps'].tolist()[:2] == [True, False]
+    assert df['ToestemmingProfielfotoInExterneApps'].isna().tolist() == [False, False, True]
+
+
+def test_column_projection(table_path):
+    storage.write_table(pd.DataFrame(ROWS), table_path, SCHEMA)
+    df = storage.read_table(table_path, SCHEMA, columns=['UUID', 'ToestemmingProfielfotoInExterneApps'])
+
+    assert list(df.columns) == ['UUID', 'ToestemmingProfielfotoInExterneApps']
+    assert df['UUID'].tolist() == ['uuid-1', 'uuid-2', 'uuid-3']
+    assert str(df['ToestemmingProfielfotoInExterneApps'].dtype) == 'boolean'
+
+
+@needs_pyarrow
+def test_none_text_in_old_feather_tables_is_missing(tmp_path):
+    # Tables harvested before a null was treated as missing hold the text 'None'.
+    path = str(tmp_path / 'uustaff_results.feather')
+    old = pd.DataFrame(ROWS).drop(columns=['ToestemmingProfielfotoInExterneApps'])
+    old = old.astype(object).where(old.notna(), 'None').astype('string')
+    storage.feather.write_feather(storage.pa.Table.from_pandas(old, preserve_index=False), path)
+
+    df = storage.read_table(path, {column: SCHEMA[column] for column in old.columns})
+    assert df['DescriptionEN'].isna().tolist() == [False, True, True]
+    assert df['DescriptionNL'].isna().tolist() == [True, False, True]
+
+
+def test_photo_only_with_consent(table_path, monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: {'fileData': page_id, 'size': 1})
+    storage.write_table(pd.DataFrame(ROWS), table_path, SCHEMA)
+
+    with_photo = []
+    for row in storage.read_table(table_path, SCHEMA).to_dict('records'):
+        person = {'uuid': row['UUID']}
+        patch_rules.apply(person, row, None)
+        if person.get('profilePhotos'):
+            with_photo.append(row['UUID'])
+    # Only an explicit True is consent, False and unknown are not.
+    assert with_photo == ['uuid-1']
+
+
+def test_missing_bio_falls_back_to_dutch(table_path, monkeypatch):
+    monkeypatch.setattr(photos, 'get_photo_payload', lambda page_id: None)
+    storage.write_table(pd.DataFrame(ROWS), table_path, SCHEMA)
+    row = storage.read_table(table_path, SCHEMA).to_dict('records')[1]
+
+    person = {'uuid': row['UUID']}
+    patch_rules.apply(person, row, None)
+    assert [info['value']['en_GB'] for info in person['profileInformation']] == ['nl bio']